@@ -2,7 +2,14 @@ import pygame
 import os
 import random
 import math
+import sys
 import time
+import heapq
+import multiprocessing
+import signal
+from multiprocessing import shared_memory
+from collections import OrderedDict, defaultdict
+import numpy as np
 
 # Инициализация Pygame
 pygame.init()
@@ -24,37 +31,227 @@ DARK_GRAY = (50, 50, 50)  # Темно-серый для Underground_Storage
 LIGHT_GRAY = (180, 180, 180)  # Светло-серый для Castle_Lawn
 FOUNTAIN_COLOR = (200, 200, 200)  # Цвет фонтана/статуи
 
+# Настройки симуляции
+SIM_TICK_RATE = 60  # Шагов симуляции в секунду, не зависит от частоты отрисовки
+SIM_TICK_MS = 1000 / SIM_TICK_RATE
+MAX_TICKS_PER_FRAME = 5  # Сколько шагов симуляции можно догнать за один кадр
+
+# Настройки отрисовки
+RENDER_FPS = 60
+DIRTY_RECTS = True  # Обновлять на экране только изменившиеся области
+DIRTY_FULL_UPDATE_RATIO = 0.4  # Доля экрана, при превышении которой обновляется весь кадр
+
 # Настройки танка
 TANK_WIDTH, TANK_HEIGHT = 40, 40
 TANK_SPEED = 2
 BULLET_SPEED = 5
 BULLET_COOLDOWN = 2000
+BULLET_RADIUS = 5
+MAX_LIVE_BULLETS = 2048  # Размер пула пуль: больше живых пуль одновременно не бывает
+
+# Владельцы пуль
+OWNER_PLAYER = 0
+OWNER_ENEMY = 1
+
+# Коды направлений и таблицы, индексируемые ими
+DIR_UP, DIR_DOWN, DIR_LEFT, DIR_RIGHT = 0, 1, 2, 3
+DIRECTION_VECTORS = ((0, -1), (0, 1), (-1, 0), (1, 0))  # Единичные векторы направлений
+
+# Управление игроком: клавиша -> направление
+PLAYER_CONTROLS = ((pygame.K_w, DIR_UP), (pygame.K_s, DIR_DOWN), (pygame.K_a, DIR_LEFT), (pygame.K_d, DIR_RIGHT))
+
+# Настройки противников
+ENEMY_MOVE_INTERVAL = 50  # Противник делает шаг раз в столько мс
+ENEMY_SHOOT_INTERVAL = 2000  # Противник стреляет не чаще раза в столько мс
+ENEMY_KEEP_DISTANCE = 150  # Ближе этого расстояния (по пути) к игроку противник не подъезжает
+
+# Настройки планировщика ИИ
+AI_FRAME_BUDGET_US = 2000  # Сколько мкс за шаг симуляции можно тратить на "мышление" противников
+AI_FAR_DISTANCE = 400  # Дальше этого расстояния (по пути) от игрока противник думает реже
+AI_FAR_INTERVAL = ENEMY_MOVE_INTERVAL * 2  # Как часто думает дальний противник, мс
+AI_MAX_CATCHUP_STEPS = 4  # Сколько пропущенных шагов противник догоняет за раз
+AI_BATCH_SIZE = 32  # Сколько противников обновляется одним векторным проходом
+
+# Настройки пакетного управления противниками
+STEER_SEPARATION_RADIUS = 80  # Противники ближе этого расстояния между центрами расталкиваются
+STEER_SEPARATION_WEIGHT = 1.5  # Вес расталкивания относительно движения к цели
+STEER_LOOKAHEAD = 10  # На сколько пикселей вперёд проверяются препятствия
+STEER_MIN_SCORE = 0.25  # При меньшем итоговом желании двигаться противник стоит на месте
+
+# Настройки карт влияния
+INFLUENCE_CELL_SIZE = 40  # Размер ячейки карт угрозы, укрытий и плотности союзников
+INFLUENCE_BULLET_LOOKAHEAD = 3  # Сколько ячеек впереди пули игрока считаются под угрозой
+INFLUENCE_VISIBILITY_SAMPLES = 48  # Точек на луче при проверке, видна ли ячейка игроку
+INFLUENCE_THREAT_WEIGHT = 1.5  # Насколько перезаряжающийся противник избегает линий огня и пуль
+INFLUENCE_COVER_WEIGHT = 0.5  # Насколько перезаряжающийся противник стремится в укрытие
+INFLUENCE_ALLY_WEIGHT = 0.5  # Насколько противник избегает ячеек, занятых союзниками
+
+# Поиск пути в отдельном процессе (если ОС умеет fork; иначе поле потока считается в основном цикле)
+PATHFINDING_WORKER = True
+
+# Максимальный размер кэша прямой видимости (пар ячеек)
+LOS_CACHE_SIZE = 50000
+
+# Размер ячейки сетки для столкновений движущихся объектов
+BROADPHASE_CELL_SIZE = 80
+
+# Размер ячейки карты занятости (для быстрых проверок свободного места)
+OCCUPANCY_CELL_SIZE = 10
+
+# Генерация карт
+MAP_ENEMY_COUNTS = {"map1": 3, "map2": 4, "map3": 6}  # Количество врагов на карте
+MAP_GENERATION_ATTEMPTS = 20  # Сколько раскладок перебрать в поисках связной
+MAP_CACHE_SIZE = 16  # Сколько сгенерированных раскладок хранить
+
+# Минимальное расстояние между точками спавна танков
+SPAWN_MIN_SEPARATION = 60
+
+# Настройки режима "Орда": противники прибывают волнами, пока игрок жив
+HORDE_MAP = "map1"  # Самая просторная карта
+HORDE_MAX_ENEMIES = 500  # Больше противников одновременно на карте не бывает
+HORDE_FIRST_WAVE = 20  # Размер первой волны
+HORDE_WAVE_GROWTH = 1.5  # Каждая следующая волна больше предыдущей во столько раз
+HORDE_WAVE_INTERVAL = 20000  # Через сколько мс приходит следующая волна (или раньше, если все убиты)
+HORDE_SPAWNS_PER_TICK = 4  # Противники выходят на карту постепенно, не больше стольких за шаг
+HORDE_SPAWN_ATTEMPTS = 8  # Сколько точек у края пробовать для одного противника
+HORDE_EDGE_MARGIN = 80  # Противники появляются не дальше этого расстояния от края карты
+HORDE_MIN_PLAYER_DISTANCE = 300  # И не ближе этого расстояния к игроку
+HORDE_FRAME_TIME_TARGET = 1000 / 60  # Целевое время кадра в режиме орды, мс
+FRAME_TIME_SMOOTHING = 0.1  # Сглаживание времени кадра для счётчика на экране
 
 # Настройки бонусов
 BONUS_SIZE = 20
 BONUS_TYPES = ["explosive_bullet", "shield", "invulnerability"]
+BONUS_COUNT = 5  # Бонусов на карте в начале матча и максимум одновременно
+BONUS_RESPAWN_INTERVAL = 15000  # Через сколько мс появляется новый бонус взамен подобранного
+BONUS_EXCLUSION_MARGIN = 60  # Бонус не появляется ближе этого расстояния к танкам и другим бонусам
 
 # Настройки препятствий
 OBSTACLE_WIDTH, OBSTACLE_HEIGHT = 80, 80
 
+# Настройки ресурсов
+ASSET_MEMORY_BUDGET = 16 * 1024 * 1024  # Максимальный объём кэша изображений в байтах
+
+# Менеджер ресурсов: каждое изображение декодируется один раз, приводится к формату экрана
+# и разделяется между всеми объектами. Давно не использованные изображения вытесняются,
+# когда кэш превышает бюджет памяти
+class AssetManager:
+    def __init__(self, memory_budget=ASSET_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.surfaces = OrderedDict()  # (путь, размер, формат) -> поверхность
+
+    @staticmethod
+    def surface_memory(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def get(self, path, size, image_format=None):
+        if image_format is None:
+            image_format = "alpha" if path.lower().endswith(".png") else "opaque"
+        key = (path, size, image_format)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = self.load(path, size, image_format)
+        self.surfaces[key] = surface
+        self.memory_used += self.surface_memory(surface)
+        self.evict()
+        return surface
+
+    def load(self, path, size, image_format):
+        if not os.path.exists(path):
+            # Если файл не найден, создаем заглушку
+            surface = pygame.Surface(size)
+            surface.fill(RED)
+            return surface.convert()
+        image = pygame.transform.scale(pygame.image.load(path), size)
+        return image.convert_alpha() if image_format == "alpha" else image.convert()
+
+    def evict(self):
+        # Самое свежее изображение остаётся в кэше, даже если оно одно превышает бюджет
+        while self.memory_used > self.memory_budget and len(self.surfaces) > 1:
+            _, surface = self.surfaces.popitem(last=False)
+            self.memory_used -= self.surface_memory(surface)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.memory_used = 0
+
+ASSETS = AssetManager()
+
 # Загрузка изображений
 def load_image(path, width, height):
-    if not os.path.exists(path):
-        # Если файл не найден, создаем заглушку
-        surf = pygame.Surface((width, height))
-        surf.fill(RED)
-        return surf
-    image = pygame.image.load(path)
-    image = pygame.transform.scale(image, (width, height))
-    return image
+    return ASSETS.get(path, (width, height))
 
 # Загрузка изображения танка
 def load_tank_image():
     return load_image(os.path.join("Sprites", "tank.png"), TANK_WIDTH, TANK_HEIGHT)
 
-# Загрузка изображений врагов
+# Загрузка изображений врагов (все варианты используют один декодированный bot.png)
 def load_enemy_images():
-    return [load_image(os.path.join("Sprites", f"bot.png"), TANK_WIDTH, TANK_HEIGHT) for i in range(1, 4)]
+    return [load_image(os.path.join("Sprites", "bot.png"), TANK_WIDTH, TANK_HEIGHT) for i in range(1, 4)]
+
+# Скины танков из набора Sprites/color_*.png
+SKIN_NAMES = [
+    "arcticwhite", "blue", "brightpink", "carrotorange", "green", "greywhite", "inverse",
+    "inverse1", "lightblue", "lightpink", "olive", "teal", "ultraviolet", "yellow",
+]
+SKIN_TINT_SLOTS = 8  # Места в атласе под командные окраски из tank.png
+SKIN_ATLAS_COLUMNS = 8
+PLAYER_SKIN = None  # None - стандартный tank.png, имя из SKIN_NAMES или цвет (r, g, b) для окраски
+
+# Атлас скинов: все скины лежат в одной поверхности, танкам выдаются её подповерхности.
+# Скин загружается в атлас только при первом использовании
+class SkinAtlas:
+    def __init__(self, capacity=len(SKIN_NAMES) + SKIN_TINT_SLOTS, size=(TANK_WIDTH, TANK_HEIGHT)):
+        self.capacity = capacity
+        self.size = size
+        self.surface = None  # Создаётся при загрузке первого скина
+        self.skins = {}  # имя скина или цвет окраски -> подповерхность атласа
+
+    def allocate(self, image):
+        if self.surface is None:
+            rows = (self.capacity + SKIN_ATLAS_COLUMNS - 1) // SKIN_ATLAS_COLUMNS
+            self.surface = pygame.Surface(
+                (self.size[0] * SKIN_ATLAS_COLUMNS, self.size[1] * rows), pygame.SRCALPHA
+            ).convert_alpha()
+        slot = len(self.skins)
+        if slot >= self.capacity:
+            # Атлас заполнен - скин живёт в отдельной поверхности
+            return image
+        rect = pygame.Rect(
+            (slot % SKIN_ATLAS_COLUMNS) * self.size[0], (slot // SKIN_ATLAS_COLUMNS) * self.size[1], *self.size
+        )
+        self.surface.blit(image, rect, special_flags=pygame.BLEND_RGBA_MAX)
+        return self.surface.subsurface(rect)
+
+    def get(self, name):
+        skin = self.skins.get(name)
+        if skin is None:
+            image = ASSETS.load(os.path.join("Sprites", f"color_{name}.png"), self.size, "alpha")
+            skin = self.allocate(image)
+            self.skins[name] = skin
+        return skin
+
+    def get_tint(self, color):
+        # Командная окраска: tank.png, умноженный на цвет команды
+        skin = self.skins.get(color)
+        if skin is None:
+            image = load_tank_image().copy()
+            image.fill(color, special_flags=pygame.BLEND_RGB_MULT)
+            skin = self.allocate(image)
+            self.skins[color] = skin
+        return skin
+
+SKINS = SkinAtlas()
+
+def get_tank_image(skin=None):
+    if skin is None:
+        return load_tank_image()
+    if isinstance(skin, tuple):
+        return SKINS.get_tint(skin)
+    return SKINS.get(skin)
 
 # Загрузка фонового изображения
 def load_background(map_name):
@@ -67,169 +264,357 @@ def load_background(map_name):
     else:
         return load_image(os.path.join("Sprites", "background.jpg"), WIDTH, HEIGHT)
 
+# Часы симуляции: все игровые таймеры считают время в шагах симуляции, а не по настенным часам
+class SimClock:
+    def __init__(self):
+        self.tick = 0
+
+    def reset(self):
+        self.tick = 0
+
+    def advance(self):
+        self.tick += 1
+
+    def now(self):
+        # Время симуляции в миллисекундах
+        return self.tick * SIM_TICK_MS
+
+SIM_CLOCK = SimClock()
+
+# Кэш повёрнутых спрайтов
+# Повороты считаются один раз на изображение и переиспользуются всеми танками с этим изображением
+DIRECTION_ANGLES = (0, 180, 90, -90)  # Угол поворота спрайта для каждого кода DIR_*
+ROTATION_STEP = 15  # Шаг квантования произвольных углов (для наведения башни)
+
+class SpriteCache:
+    def __init__(self, angle_step=ROTATION_STEP):
+        self.angle_step = angle_step
+        self.images = {}  # id(изображения) -> изображение, чтобы id не переиспользовался
+        self.rotations = {}  # (id(изображения), угол) -> повёрнутое изображение
+        self.directions = {}  # id(изображения) -> повёрнутые изображения по кодам направлений
+
+    def quantize(self, angle):
+        return int(round(angle / self.angle_step)) * self.angle_step % 360
+
+    def get(self, image, angle):
+        # Повёрнутое изображение для угла, округлённого до шага angle_step
+        angle = self.quantize(angle)
+        key = (id(image), angle)
+        rotated = self.rotations.get(key)
+        if rotated is None:
+            self.images[id(image)] = image
+            rotated = image if angle == 0 else pygame.transform.rotate(image, angle)
+            self.rotations[key] = rotated
+        return rotated
+
+    def get_directions(self, image):
+        # Все четыре направления танка строятся сразу при первой загрузке изображения
+        sprites = self.directions.get(id(image))
+        if sprites is None:
+            sprites = tuple(self.get(image, angle) for angle in DIRECTION_ANGLES)
+            self.directions[id(image)] = sprites
+        return sprites
+
+SPRITE_CACHE = SpriteCache()
+
+# Кэш шрифтов и отрендеренного текста
+FONT_NAME = "Arial"
+HUD_FONT_SIZE = 30
+FONT_CACHE = {}  # (имя, размер) -> шрифт
+TEXT_CACHE = {}  # (текст, размер, цвет) -> поверхность
+
+def get_font(size, name=FONT_NAME):
+    key = (name, size)
+    font = FONT_CACHE.get(key)
+    if font is None:
+        font = pygame.font.SysFont(name, size)
+        FONT_CACHE[key] = font
+    return font
+
+def render_text(text, size, color):
+    key = (text, size, color)
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        surface = get_font(size).render(text, True, color)
+        TEXT_CACHE[key] = surface
+    return surface
+
+# Атлас цифр: символы рендерятся один раз, числа собираются из готовых глифов
+class DigitAtlas:
+    GLYPHS = "0123456789-"
+
+    def __init__(self, size, color):
+        glyphs = [get_font(size).render(char, True, color) for char in self.GLYPHS]
+        self.height = max(glyph.get_height() for glyph in glyphs)
+        self.surface = pygame.Surface((sum(glyph.get_width() for glyph in glyphs), self.height), pygame.SRCALPHA)
+        self.rects = {}
+        x = 0
+        for char, glyph in zip(self.GLYPHS, glyphs):
+            self.surface.blit(glyph, (x, 0))
+            self.rects[char] = pygame.Rect(x, 0, glyph.get_width(), self.height)
+            x += glyph.get_width()
+
+    def render(self, number):
+        text = str(number)
+        surface = pygame.Surface((sum(self.rects[char].width for char in text), self.height), pygame.SRCALPHA)
+        x = 0
+        for char in text:
+            # BLEND_RGBA_MAX копирует глиф на прозрачный фон без затемнения краёв
+            surface.blit(self.surface, (x, 0), self.rects[char], special_flags=pygame.BLEND_RGBA_MAX)
+            x += self.rects[char].width
+        return surface
+
+DIGIT_ATLASES = {}  # (размер, цвет) -> атлас цифр
+
+def get_digit_atlas(size, color):
+    key = (size, color)
+    atlas = DIGIT_ATLASES.get(key)
+    if atlas is None:
+        atlas = DigitAtlas(size, color)
+        DIGIT_ATLASES[key] = atlas
+    return atlas
+
+# Поле HUD: подпись рендерится один раз, значение перерисовывается только при изменении
+class HudField:
+    def __init__(self, label, pos, size=HUD_FONT_SIZE, color=WHITE):
+        self.pos = pos
+        self.size = size
+        self.color = color
+        self.label_surface = render_text(label, size, color)
+        self.value = None
+        self.surface = self.label_surface
+
+    def set(self, value):
+        if value == self.value:
+            return False
+        self.value = value
+        if isinstance(value, int):
+            value_surface = get_digit_atlas(self.size, self.color).render(value)
+        else:
+            value_surface = render_text(str(value), self.size, self.color)
+        label_width = self.label_surface.get_width()
+        height = max(self.label_surface.get_height(), value_surface.get_height())
+        self.surface = pygame.Surface((label_width + value_surface.get_width(), height), pygame.SRCALPHA)
+        self.surface.blit(self.label_surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        self.surface.blit(value_surface, (label_width, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        return True
+
+    def draw(self, win):
+        return win.blit(self.surface, self.pos)
+
+class Hud:
+    def __init__(self):
+        self.fields = {}
+
+    def add(self, name, label, pos):
+        self.fields[name] = HudField(label, pos)
+
+    def set(self, name, value):
+        return self.fields[name].set(value)
+
+    def draw(self, win):
+        return [field.draw(win) for field in self.fields.values()]
+
+# Общий цикл меню: поток блокируется в pygame.event.wait и не тратит процессор,
+# экран перерисовывается только когда событие что-то изменило
+class MenuScreen:
+    def __init__(self):
+        self.done = False
+        self.result = None
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+
+    def draw(self, win):
+        pass
+
+    def handle_event(self, event):
+        # Возвращает True, если экран нужно перерисовать
+        return False
+
+def run_menu(screen, win=WIN):
+    screen.draw(win)
+    pygame.display.flip()
+    while not screen.done:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            return None
+        redraw = screen.handle_event(event)
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            redraw = True
+        if redraw and not screen.done:
+            screen.draw(win)
+            pygame.display.flip()
+    return screen.result
+
+def blit_centered(surface, text, y):
+    surface.blit(text, (WIDTH // 2 - text.get_width() // 2, y))
+
+# Экран ввода имени игрока
+class NameInputScreen(MenuScreen):
+    def __init__(self):
+        super().__init__()
+        self.name = ""
+        self.font = get_font(40)
+        # Неизменная часть экрана рендерится один раз
+        self.static = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.static.fill(WHITE)
+        blit_centered(self.static, render_text("Введите ваше имя:", 40, BLACK), HEIGHT // 2 - 50)
+        self.name_surface = self.font.render(self.name, True, BLACK)
+
+    def draw(self, win):
+        win.blit(self.static, (0, 0))
+        blit_centered(win, self.name_surface, HEIGHT // 2 + 10)
+
+    def handle_event(self, event):
+        if event.type != pygame.KEYDOWN:
+            return False
+        if event.key == pygame.K_RETURN:
+            self.finish(self.name if self.name else "Игрок")
+            return False
+        if event.key == pygame.K_BACKSPACE:
+            name = self.name[:-1]
+        else:
+            name = self.name + event.unicode
+        if name == self.name:
+            return False
+        self.name = name
+        self.name_surface = self.font.render(self.name, True, BLACK)
+        return True
+
 # Функция для ввода имени игрока
 def get_player_name():
     pygame.display.set_caption("Введите ваше имя")
-    name = ""
-    font = pygame.font.SysFont("Arial", 40)
-    input_active = True
-    
-    while input_active:
-        WIN.fill(WHITE)
-        text_surface = font.render("Введите ваше имя:", True, BLACK)
-        name_surface = font.render(name, True, BLACK)
-        
-        WIN.blit(text_surface, (WIDTH//2 - text_surface.get_width()//2, HEIGHT//2 - 50))
-        WIN.blit(name_surface, (WIDTH//2 - name_surface.get_width()//2, HEIGHT//2 + 10))
-        
-        pygame.display.flip()
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return None
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_RETURN:
-                    input_active = False
-                elif event.key == pygame.K_BACKSPACE:
-                    name = name[:-1]
-                else:
-                    name += event.unicode
-    
+    name = run_menu(NameInputScreen())
+    if name is None:
+        return None
     pygame.display.set_caption("World of Tanks Nintendo Switch edition")
-    return name if name else "Игрок"
+    return name
+
+# Кнопка меню с заранее отрендеренной подписью
+class MenuButton:
+    def __init__(self, rect, label):
+        self.rect = pygame.Rect(rect)
+        self.label = render_text(label, 40, BLACK)
+
+    def draw(self, surface, label_x=None):
+        pygame.draw.rect(surface, GREEN, self.rect)
+        if label_x is None:
+            label_x = WIDTH // 2 - self.label.get_width() // 2
+        surface.blit(self.label, (label_x, self.rect.y + 10))
 
 # Титульный экран
-def title_screen():
-    run = True
-    clock = pygame.time.Clock()
+class TitleScreen(MenuScreen):
+    def __init__(self):
+        super().__init__()
+        self.buttons = {
+            "map1": MenuButton((WIDTH // 2 - 100, 200, 200, 50), "Подземелье"),
+            "map2": MenuButton((WIDTH // 2 - 100, 300, 200, 50), "Замок"),
+            "map3": MenuButton((WIDTH // 2 - 100, 400, 200, 50), "Город"),
+            "horde": MenuButton((WIDTH // 2 - 100, 500, 200, 50), "Орда"),
+        }
+        # Фон, заголовок и кнопки не меняются, поэтому экран собирается один раз
+        self.static = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.static.blit(load_background(None), (0, 0))
+        blit_centered(self.static, render_text("Выберите карту", 40, WHITE), 100)
+        for button in self.buttons.values():
+            button.draw(self.static)
 
-    # Загрузка фона
-    background = load_background(None)
-
-    while run:
-        clock.tick(60)
-        WIN.blit(background, (0, 0))
-
-        # Отрисовка кнопок
-        font = pygame.font.SysFont("Arial", 40)
-        text = font.render("Выберите карту", True, WHITE)
-        WIN.blit(text, (WIDTH // 2 - text.get_width() // 2, 100))
-
-        # Кнопка карты 1
-        map1_button = pygame.Rect(WIDTH // 2 - 100, 200, 200, 50)
-        pygame.draw.rect(WIN, GREEN, map1_button)
-        text = font.render("Подземелье", True, BLACK)
-        WIN.blit(text, (WIDTH // 2 - text.get_width() // 2, 210))
-
-        # Кнопка карты 2
-        map2_button = pygame.Rect(WIDTH // 2 - 100, 300, 200, 50)
-        pygame.draw.rect(WIN, GREEN, map2_button)
-        text = font.render("Замок", True, BLACK)
-        WIN.blit(text, (WIDTH // 2 - text.get_width() // 2, 310))
-
-        # Кнопка карты 3
-        map3_button = pygame.Rect(WIDTH // 2 - 100, 400, 200, 50)
-        pygame.draw.rect(WIN, GREEN, map3_button)
-        text = font.render("Город", True, BLACK)
-        WIN.blit(text, (WIDTH // 2 - text.get_width() // 2, 410))
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return None
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if map1_button.collidepoint(event.pos):
-                    return "map1"
-                elif map2_button.collidepoint(event.pos):
-                    return "map2"
-                elif map3_button.collidepoint(event.pos):
-                    return "map3"
+    def draw(self, win):
+        win.blit(self.static, (0, 0))
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            for map_name, button in self.buttons.items():
+                if button.rect.collidepoint(event.pos):
+                    self.finish(map_name)
+                    break
+        return False
 
-        pygame.display.update()
+def title_screen():
+    return run_menu(TitleScreen())
 
 # Класс танка
+# Положение хранится только в rect, направление - целочисленным кодом DIR_*
 class Tank:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+    __slots__ = (
+        "rect", "prev_x", "prev_y", "hp", "bullets", "last_shot", "shield", "invulnerable",
+        "invulnerable_start_time", "image", "sprites", "direction",
+    )
+
+    def __init__(self, x, y, image=None):
+        self.rect = pygame.Rect(x, y, TANK_WIDTH, TANK_HEIGHT)
+        self.prev_x = self.rect.x  # Положение на предыдущем шаге симуляции
+        self.prev_y = self.rect.y
         self.hp = 15
         self.bullets = 5
-        self.last_shot = pygame.time.get_ticks()
+        self.last_shot = SIM_CLOCK.now()
         self.shield = False
         self.invulnerable = False
         self.invulnerable_start_time = 0
-        self.image = load_tank_image()
-        self.direction = "up"  # Направление танка
-        self.dx = 0  # Направление по оси X
-        self.dy = 0  # Направление по оси Y
-        self.rect = pygame.Rect(x, y, TANK_WIDTH, TANK_HEIGHT)
-
-    def draw(self, win):
-        # Поворачиваем изображение в зависимости от направления
-        if self.direction == "up":
-            rotated_image = self.image
-        elif self.direction == "down":
-            rotated_image = pygame.transform.rotate(self.image, 180)
-        elif self.direction == "left":
-            rotated_image = pygame.transform.rotate(self.image, 90)
-        elif self.direction == "right":
-            rotated_image = pygame.transform.rotate(self.image, -90)
-        win.blit(rotated_image, (self.x, self.y))
-
-    def move(self, dx, dy, obstacles, tanks):
-        # Сохраняем направление движения
-        self.dx = dx
-        self.dy = dy
-
-        # Проверка границ окна
-        new_x = self.x + dx * TANK_SPEED
-        new_y = self.y + dy * TANK_SPEED
-
-        # Обновляем rect для проверки столкновений
+        self.image = image if image is not None else load_tank_image()
+        self.sprites = SPRITE_CACHE.get_directions(self.image)
+        self.direction = DIR_UP  # Направление танка
+
+    def save_position(self):
+        self.prev_x = self.rect.x
+        self.prev_y = self.rect.y
+
+    def draw(self, win, alpha=1.0):
+        # Положение интерполируется между двумя последними шагами симуляции
+        x = self.prev_x + (self.rect.x - self.prev_x) * alpha
+        y = self.prev_y + (self.rect.y - self.prev_y) * alpha
+        # Повёрнутые изображения берутся из кэша по коду направления
+        return win.blit(self.sprites[self.direction], (round(x), round(y)))
+
+    def move(self, dx, dy, obstacle_grid, tank_grid):
+        rect = self.rect
+        new_x = rect.x + round(dx * TANK_SPEED)
+        new_y = rect.y + round(dy * TANK_SPEED)
+
+        # Прямоугольник для проверки столкновений
         new_rect = pygame.Rect(new_x, new_y, TANK_WIDTH, TANK_HEIGHT)
 
         # Проверка столкновений с препятствиями
-        collision = False
-        for obstacle in obstacles:
-            if new_rect.colliderect(obstacle.rect):
-                collision = True
-                break
+        collision = obstacle_grid.collides(new_rect)
 
-        # Проверка столкновений с другими танками
-        for tank in tanks:
-            if tank != self and new_rect.colliderect(tank.rect):
-                collision = True
-                break
+        # Проверка столкновений с другими танками (только с соседями по сетке)
+        if not collision:
+            for tank in tank_grid.query(new_rect):
+                if tank is not self:
+                    collision = True
+                    break
 
+        # Проверка границ окна
         if not collision:
             if 0 <= new_x <= WIDTH - TANK_WIDTH:
-                self.x = new_x
+                rect.x = new_x
             if 0 <= new_y <= HEIGHT - TANK_HEIGHT:
-                self.y = new_y
-            self.rect.x = self.x
-            self.rect.y = self.y
-
-        # Обновляем направление
-        if dx > 0:
-            self.direction = "right"
-        elif dx < 0:
-            self.direction = "left"
-        if dy > 0:
-            self.direction = "down"
-        elif dy < 0:
-            self.direction = "up"
-
-    def shoot(self):
-        current_time = pygame.time.get_ticks()
+                rect.y = new_y
+            tank_grid.update(self)
+
+        # Обновляем направление (вертикальное движение важнее горизонтального)
+        if dy:
+            self.direction = DIR_DOWN if dy > 0 else DIR_UP
+        elif dx:
+            self.direction = DIR_RIGHT if dx > 0 else DIR_LEFT
+        return not collision
+
+    def shoot(self, bullet_store, owner):
+        current_time = SIM_CLOCK.now()
         if current_time - self.last_shot > BULLET_COOLDOWN and self.bullets > 0:
+            # Если пул пуль заполнен, выстрел не тратит снаряд
+            if not bullet_store.spawn(self.rect.centerx, self.rect.centery, self.direction, owner):
+                return False
             self.bullets -= 1
             self.last_shot = current_time
-            return Bullet(self.x + TANK_WIDTH // 2, self.y + TANK_HEIGHT // 2, self.direction)
-        return None
+            return True
+        return False
 
     def recharge(self):
-        current_time = pygame.time.get_ticks()
+        current_time = SIM_CLOCK.now()
         if self.bullets < 5 and current_time - self.last_shot > BULLET_COOLDOWN:
             self.bullets += 1
             self.last_shot = current_time
@@ -246,120 +631,1035 @@ class Tank:
 
     def activate_invulnerability(self):
         self.invulnerable = True
-        self.invulnerable_start_time = pygame.time.get_ticks()
+        self.invulnerable_start_time = SIM_CLOCK.now()
 
     def update_invulnerability(self):
-        if self.invulnerable and pygame.time.get_ticks() - self.invulnerable_start_time > 10000:
+        if self.invulnerable and SIM_CLOCK.now() - self.invulnerable_start_time > 10000:
             self.invulnerable = False
 
-    def get_rect(self):
-        return self.rect
-
-# Класс пули
-class Bullet:
-    def __init__(self, x, y, direction):
-        self.x = x
-        self.y = y
-        self.radius = 5
-        self.color = YELLOW
-        self.direction = direction
-        self.rect = pygame.Rect(x - self.radius, y - self.radius, self.radius * 2, self.radius * 2)
-
-    def draw(self, win):
-        pygame.draw.circle(win, self.color, (self.x, self.y), self.radius)
-
-    def move(self, obstacles):
-        if self.direction == "up":
-            self.y -= BULLET_SPEED
-        elif self.direction == "down":
-            self.y += BULLET_SPEED
-        elif self.direction == "left":
-            self.x -= BULLET_SPEED
-        elif self.direction == "right":
-            self.x += BULLET_SPEED
-        
-        # Обновляем rect
-        self.rect.x = self.x - self.radius
-        self.rect.y = self.y - self.radius
-
-        # Проверка столкновения с препятствиями
-        for obstacle in obstacles:
-            if self.rect.colliderect(obstacle.rect):
-                return True  # Пуля должна быть уничтожена
-        return False
-
-    def get_rect(self):
-        return self.rect
+# Хранилище пуль: структура массивов NumPy. Движение всех пуль, проверка препятствий
+# и попаданий в танки выполняются несколькими векторными операциями за шаг.
+# Массивы выделяются один раз на max_live пуль, места погибших пуль переиспользуются
+class BulletStore:
+    FLOAT_FIELDS = ("x", "y", "prev_x", "prev_y", "vx", "vy", "radius")
+
+    def __init__(self, max_live=MAX_LIVE_BULLETS):
+        self.count = 0  # Живые пули занимают первые count элементов массивов
+        self.max_live = max_live
+        self.high_water = 0  # Сколько мест пула уже когда-либо было занято
+        # Метрики
+        self.spawned = 0
+        self.recycled = 0  # Выстрелы, занявшие место погибшей пули
+        self.rejected = 0  # Выстрелы, не поместившиеся в пул
+        self.culled = 0  # Пули, вылетевшие за пределы арены
+        for name in self.FLOAT_FIELDS:
+            setattr(self, name, np.zeros(max_live, dtype=np.float64))
+        self.owner = np.zeros(max_live, dtype=np.int8)
+        self.sprite = pygame.Surface((BULLET_RADIUS * 2, BULLET_RADIUS * 2), pygame.SRCALPHA)
+        pygame.draw.circle(self.sprite, YELLOW, (BULLET_RADIUS, BULLET_RADIUS), BULLET_RADIUS)
+
+    def metrics(self):
+        return {
+            "live": self.count,
+            "spawned": self.spawned,
+            "recycled": self.recycled,
+            "rejected": self.rejected,
+            "culled": self.culled,
+        }
+
+    def spawn(self, x, y, direction, owner, radius=BULLET_RADIUS):
+        # Возвращает False, если пул заполнен
+        i = self.count
+        if i == self.max_live:
+            self.rejected += 1
+            return False
+        if i < self.high_water:
+            self.recycled += 1
+        else:
+            self.high_water = i + 1
+        self.spawned += 1
+        dx, dy = DIRECTION_VECTORS[direction]
+        self.x[i] = self.prev_x[i] = x
+        self.y[i] = self.prev_y[i] = y
+        self.vx[i] = dx * BULLET_SPEED
+        self.vy[i] = dy * BULLET_SPEED
+        self.radius[i] = radius
+        self.owner[i] = owner
+        self.count += 1
+        return True
+
+    def save_positions(self):
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+
+    def move(self):
+        n = self.count
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+
+    def overlaps(self, rects, rows=None):
+        # Матрица пересечений (пули x прямоугольники), rects - массив (k, 4): x, y, ширина, высота.
+        # rows - индексы проверяемых пуль (по умолчанию все живые)
+        if rows is None:
+            rows = slice(0, self.count)
+        x = self.x[rows, None]
+        y = self.y[rows, None]
+        r = self.radius[rows, None]
+        left, top = rects[:, 0], rects[:, 1]
+        right, bottom = left + rects[:, 2], top + rects[:, 3]
+        return (x - r < right) & (x + r > left) & (y - r < bottom) & (y + r > top)
+
+    def out_of_bounds(self, width=WIDTH, height=HEIGHT):
+        # Пули, целиком покинувшие арену
+        n = self.count
+        x, y, r = self.x[:n], self.y[:n], self.radius[:n]
+        return (x + r <= 0) | (x - r >= width) | (y + r <= 0) | (y - r >= height)
+
+    def remove(self, mask):
+        # Удаление пуль по маске со сдвигом живых пуль в начало массивов
+        n = self.count
+        keep = ~mask[:n]
+        alive = int(keep.sum())
+        if alive == n:
+            return
+        for name in self.FLOAT_FIELDS + ("owner",):
+            array = getattr(self, name)
+            array[:alive] = array[:n][keep]
+        self.count = alive
+
+    def draw(self, win, alpha=1.0):
+        # Положения интерполируются между двумя последними шагами симуляции
+        n = self.count
+        if not n:
+            return []
+        x = self.prev_x[:n] + (self.x[:n] - self.prev_x[:n]) * alpha - self.radius[:n]
+        y = self.prev_y[:n] + (self.y[:n] - self.prev_y[:n]) * alpha - self.radius[:n]
+        sprite = self.sprite
+        return win.blits([(sprite, position) for position in zip(np.rint(x).tolist(), np.rint(y).tolist())])
+
+def rects_to_array(rects):
+    return np.array([tuple(rect) for rect in rects], dtype=np.float64).reshape(-1, 4)
 
 # Класс бонуса
 class Bonus:
+    __slots__ = ("rect", "type", "color")
+
     def __init__(self, x, y):
-        self.x = x
-        self.y = y
+        self.rect = pygame.Rect(x, y, BONUS_SIZE, BONUS_SIZE)
         self.type = random.choice(BONUS_TYPES)
         self.color = GREEN if self.type == "shield" else BLUE if self.type == "invulnerability" else RED
-        self.rect = pygame.Rect(x, y, BONUS_SIZE, BONUS_SIZE)
 
     def draw(self, win):
-        pygame.draw.rect(win, self.color, (self.x, self.y, BONUS_SIZE, BONUS_SIZE))
-
-    def get_rect(self):
-        return self.rect
+        return pygame.draw.rect(win, self.color, self.rect)
 
 # Класс препятствия
 class Obstacle:
+    __slots__ = ("rect", "color")
+
     def __init__(self, x, y, color):
-        self.x = x
-        self.y = y
-        self.width = OBSTACLE_WIDTH
-        self.height = OBSTACLE_HEIGHT
+        self.rect = pygame.Rect(x, y, OBSTACLE_WIDTH, OBSTACLE_HEIGHT)
         self.color = color
-        self.rect = pygame.Rect(x, y, self.width, self.height)
 
     def draw(self, win):
-        pygame.draw.rect(win, self.color, (self.x, self.y, self.width, self.height))
-
-    def get_rect(self):
-        return self.rect
+        return pygame.draw.rect(win, self.color, self.rect)
 
 # Класс противника
 class EnemyTank(Tank):
+    __slots__ = ("target", "move_timer", "shoot_timer", "influence_cell")
+
     def __init__(self, x, y, target, image):
-        super().__init__(x, y)
+        super().__init__(x, y, image)
         self.target = target
-        self.move_timer = pygame.time.get_ticks()
-        self.shoot_timer = pygame.time.get_ticks()
-        self.image = image
-
-    def update(self, obstacles, tanks):
-        # Движение к цели
-        current_time = pygame.time.get_ticks()
-        if current_time - self.move_timer > 1000:
-            self.move_timer = current_time
-            dx = self.target.x - self.x
-            dy = self.target.y - self.y
-            distance = math.hypot(dx, dy)
-            if distance != 0:
-                dx /= distance
-                dy /= distance
-            self.move(dx, dy, obstacles, tanks)
-
-        # Стрельба в цель
-        if current_time - self.shoot_timer > 2000:
-            self.shoot_timer = current_time
-            return self.shoot()
-        return None
+        self.move_timer = SIM_CLOCK.now()
+        self.shoot_timer = SIM_CLOCK.now()
+        self.influence_cell = None  # Ячейка, учтённая в карте плотности союзников
+
+    def reloading(self):
+        return SIM_CLOCK.now() - self.shoot_timer <= ENEMY_SHOOT_INTERVAL
+
+    def update(self, direction, obstacle_grid, tank_grid, bullet_store, line_of_sight):
+        # Вызывается планировщиком ИИ с направлением, посчитанным пакетно (Steering).
+        # Противник, которого давно не обновляли (дальний или отложенный из-за бюджета),
+        # догоняет пропущенные шаги
+        current_time = SIM_CLOCK.now()
+        steps = min(max(round((current_time - self.move_timer) / ENEMY_MOVE_INTERVAL), 1), AI_MAX_CATCHUP_STEPS)
+        self.move_timer = current_time
+        if direction >= 0:
+            for _ in range(steps):
+                if not self.follow(direction, obstacle_grid, tank_grid):
+                    break
+
+        # Стрельба в цель, только если есть чистый выстрел
+        if not self.reloading():
+            direction = self.aim(line_of_sight)
+            if direction is not None:
+                self.direction = direction
+                self.shoot_timer = current_time
+                return self.shoot(bullet_store, OWNER_ENEMY)
+        return False
+
+    def aim(self, line_of_sight):
+        # Пули летят вдоль осей, поэтому цель должна быть на одной линии с танком
+        # и между ними не должно быть препятствий. Возвращает направление выстрела или None
+        x, y = self.rect.center
+        target_x, target_y = self.target.rect.center
+        if abs(target_x - x) < TANK_WIDTH // 2:
+            direction = DIR_DOWN if target_y > y else DIR_UP
+        elif abs(target_y - y) < TANK_HEIGHT // 2:
+            direction = DIR_RIGHT if target_x > x else DIR_LEFT
+        else:
+            return None
+        if not line_of_sight.visible(x, y, target_x, target_y):
+            return None
+        return direction
+
+    def follow(self, direction, obstacle_grid, tank_grid):
+        # Один шаг в направлении direction. Возвращает True, если танк сдвинулся
+        dx, dy = DIRECTION_VECTORS[direction]
+        if self.move(dx, dy, obstacle_grid, tank_grid):
+            return True
+        # Поле потока строится по углам ячеек: если танк стоит между ними и упёрся,
+        # он выравнивается поперёк движения по углу своей ячейки, чтобы пройти в проход
+        x, y = self.rect.topleft
+        offset = (y if dx else x) % OCCUPANCY_CELL_SIZE
+        if offset:
+            moved = self.move(0 if dx else -1, -1 if dx else 0, obstacle_grid, tank_grid)
+            self.direction = direction
+            return moved
+        return False
 
-# Функция для проверки, находится ли точка в препятствии
-def is_position_valid(x, y, obstacles, tank_size=TANK_WIDTH):
-    temp_rect = pygame.Rect(x, y, tank_size, tank_size)
-    for obstacle in obstacles:
-        if temp_rect.colliderect(obstacle.rect):
+    def think_interval(self, flow_field):
+        # Уровень детализации ИИ: противники далеко от игрока (по пути) думают реже.
+        # Вся арена помещается на экран, поэтому отдельного уровня для невидимых нет
+        x, y = self.rect.topleft
+        if flow_field.distance_at(x, y) * flow_field.cell_size > AI_FAR_DISTANCE:
+            return AI_FAR_INTERVAL
+        return ENEMY_MOVE_INTERVAL
+
+# Планировщик ИИ: противники думают не каждый шаг, а по очереди из кучи, упорядоченной
+# по времени следующего обновления. За шаг симуляции обрабатываются только те, чьё время
+# пришло, и только пока не исчерпан бюджет; остальные остаются в начале очереди до следующего шага
+class AiScheduler:
+    def __init__(self, budget_us=AI_FRAME_BUDGET_US):
+        self.budget_ns = budget_us * 1000
+        self.queue = []  # куча (время следующего обновления, порядковый номер, танк)
+        self.next_id = 0  # Номер различает записи с одинаковым временем, танки не сравниваются
+        self.updates = 0  # Сколько обновлений выполнено
+        self.overruns = 0  # Сколько раз бюджет заканчивался раньше очереди
+
+    def add(self, enemy, delay=0):
+        heapq.heappush(self.queue, (SIM_CLOCK.now() + delay, self.next_id, enemy))
+        self.next_id += 1
+
+    def run(self, think, batch_size=AI_BATCH_SIZE):
+        # think(enemies) обновляет пакет противников и возвращает интервалы до их следующих обновлений
+        queue = self.queue
+        now = SIM_CLOCK.now()
+        due = now + SIM_TICK_MS / 2  # Время дискретно: всё, что наступает в пределах этого шага
+        deadline = time.perf_counter_ns() + self.budget_ns
+        done = 0
+        while queue and queue[0][0] <= due:
+            # Хотя бы один пакет за шаг, чтобы очередь всегда продвигалась
+            if done and time.perf_counter_ns() >= deadline:
+                self.overruns += 1
+                break
+            batch = []
+            while queue and queue[0][0] <= due and len(batch) < batch_size:
+                _, order, enemy = heapq.heappop(queue)
+                if enemy.hp > 0:  # Убитые противники выпадают из очереди
+                    batch.append((order, enemy))
+            if not batch:
+                continue
+            intervals = think([enemy for _, enemy in batch])
+            for (order, enemy), interval in zip(batch, intervals):
+                heapq.heappush(queue, (now + interval, order, enemy))
+            done += len(batch)
+        self.updates += done
+
+# Статический слой: фон и препятствия запекаются в одну поверхность на весь матч
+class StaticLayer:
+    def __init__(self, background, obstacles):
+        self.background = background
+        self.obstacles = obstacles
+        self.surface = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.dirty = []  # Области, которые нужно перезапечь перед следующей отрисовкой
+        self.bake()
+
+    def bake(self, rect=None):
+        # Перерисовка фона и препятствий в области rect (по умолчанию весь экран)
+        area = self.surface.get_rect() if rect is None else pygame.Rect(rect).clip(self.surface.get_rect())
+        self.surface.set_clip(area)
+        self.surface.blit(self.background, area.topleft, area)
+        for obstacle in self.obstacles:
+            if obstacle.rect.colliderect(area):
+                obstacle.draw(self.surface)
+        self.surface.set_clip(None)
+        return area
+
+    def invalidate(self, rect):
+        # Вызывается при изменении препятствий в области rect
+        self.dirty.append(pygame.Rect(rect))
+
+    def rebake(self):
+        baked = [self.bake(rect) for rect in self.dirty]
+        self.dirty.clear()
+        return baked
+
+# Отрисовка по "грязным" прямоугольникам
+# Каждый кадр из статического слоя восстанавливаются только области, где в прошлом кадре
+# были танки, пули, бонусы и HUD, и на экран выводятся только они
+class DirtyRenderer:
+    def __init__(self, static_layer, enabled=DIRTY_RECTS, full_update_ratio=DIRTY_FULL_UPDATE_RATIO):
+        self.static_layer = static_layer
+        self.enabled = enabled
+        self.max_dirty_area = WIDTH * HEIGHT * full_update_ratio
+        self.previous = []  # Области, нарисованные в прошлом кадре
+        self.current = []  # Области, нарисованные в текущем кадре
+        self.restored = []  # Перезапечённые области статического слоя
+        self.full_update = True  # Первый кадр выводится целиком
+
+    def force_full_update(self):
+        # Следующий кадр выводится целиком (например, после того как окно было перекрыто)
+        self.full_update = True
+
+    def begin(self, win):
+        surface = self.static_layer.surface
+        self.restored = self.static_layer.rebake()
+        if self.full_update or not self.enabled:
+            win.blit(surface, (0, 0))
+            return
+        for rect in self.previous + self.restored:
+            win.blit(surface, rect, rect)
+
+    def add(self, rect):
+        self.current.append(rect)
+        return rect
+
+    def add_all(self, rects):
+        self.current.extend(rects)
+
+    def end(self):
+        rects = self.previous + self.current + self.restored
+        dirty_area = sum(rect.width * rect.height for rect in rects)
+        if self.full_update or not self.enabled or dirty_area > self.max_dirty_area:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        self.previous = self.current
+        self.current = []
+        self.full_update = False
+
+# Пространственный хеш препятствий: равномерная сетка, строится один раз на карту.
+# Проверка прямоугольника затрагивает только препятствия из ячеек, которые он перекрывает
+class ObstacleGrid:
+    def __init__(self, obstacles, cell_size=OBSTACLE_WIDTH):
+        self.obstacles = obstacles
+        self.cell_size = cell_size
+        self.cells = {}  # (столбец, строка) -> препятствия, перекрывающие ячейку
+        for obstacle in obstacles:
+            for cell in self.cells_for(obstacle.rect):
+                self.cells.setdefault(cell, []).append(obstacle)
+
+    def cells_for(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def collides(self, rect):
+        cells = self.cells
+        for cell in self.cells_for(rect):
+            bucket = cells.get(cell)
+            if bucket:
+                for obstacle in bucket:
+                    if rect.colliderect(obstacle.rect):
+                        return True
+        return False
+
+# Динамическая широкая фаза для движущихся объектов: свободная (loose) сетка.
+# Объект лежит в ячейке своего центра и переносится в другую ячейку только при её смене,
+# запрос расширяется на половину наибольшего размера объекта. Удаление - перестановкой с последним
+class LooseGrid:
+    def __init__(self, cell_size=BROADPHASE_CELL_SIZE, max_size=TANK_WIDTH):
+        self.cell_size = cell_size
+        self.margin = (max_size + 1) // 2
+        self.cells = {}  # (столбец, строка) -> объекты, чей центр лежит в ячейке
+        self.slots = {}  # объект -> (ячейка, индекс в ячейке)
+
+    def cell_of(self, rect):
+        return rect.centerx // self.cell_size, rect.centery // self.cell_size
+
+    def insert(self, entity):
+        cell = self.cell_of(entity.rect)
+        bucket = self.cells.setdefault(cell, [])
+        self.slots[entity] = (cell, len(bucket))
+        bucket.append(entity)
+
+    def remove(self, entity):
+        cell, index = self.slots.pop(entity)
+        bucket = self.cells[cell]
+        last = bucket.pop()
+        if last is not entity:
+            bucket[index] = last
+            self.slots[last] = (cell, index)
+
+    def update(self, entity):
+        if self.cell_of(entity.rect) != self.slots[entity][0]:
+            self.remove(entity)
+            self.insert(entity)
+
+    def query(self, rect):
+        # Объекты, прямоугольники которых пересекаются с rect
+        size = self.cell_size
+        margin = self.margin
+        cells = self.cells
+        found = []
+        for cx in range((rect.left - margin) // size, (rect.right + margin - 1) // size + 1):
+            for cy in range((rect.top - margin) // size, (rect.bottom + margin - 1) // size + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    for entity in bucket:
+                        if rect.colliderect(entity.rect):
+                            found.append(entity)
+        return found
+
+# Карта занятости: булев массив NumPy с ячейками cell_size и таблица префиксных сумм по нему.
+# Вопрос "свободен ли прямоугольник AxB" решается четырьмя обращениями к таблице.
+# Ячейка занята, если её хоть немного задевает препятствие, поэтому ответ консервативный:
+# свободным прямоугольник считается только если он точно не пересекает препятствий
+class OccupancyGrid:
+    def __init__(self, obstacles, cell_size=OCCUPANCY_CELL_SIZE, width=WIDTH, height=HEIGHT):
+        self.cell_size = cell_size
+        self.width = width
+        self.height = height
+        self.cols = -(-width // cell_size)
+        self.rows = -(-height // cell_size)
+        self.blocked = np.zeros((self.rows, self.cols), dtype=bool)
+        for obstacle in obstacles:
+            rect = obstacle.rect.clip(pygame.Rect(0, 0, width, height))
+            if rect.width and rect.height:
+                self.blocked[
+                    rect.top // cell_size:-(-rect.bottom // cell_size),
+                    rect.left // cell_size:-(-rect.right // cell_size),
+                ] = True
+        # sat[r, c] - число занятых ячеек в строках < r и столбцах < c
+        self.sat = np.zeros((self.rows + 1, self.cols + 1), dtype=np.int32)
+        self.sat[1:, 1:] = self.blocked.cumsum(axis=0).cumsum(axis=1)
+
+    def blocked_cells(self, col0, row0, col1, row1):
+        # Число занятых ячеек в столбцах [col0, col1) и строках [row0, row1)
+        sat = self.sat
+        return int(sat[row1, col1] - sat[row0, col1] - sat[row1, col0] + sat[row0, col0])
+
+    def is_rect_free(self, x, y, width, height):
+        # Области за пределами арены считаются занятыми
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height:
             return False
-    return True
+        size = self.cell_size
+        return self.blocked_cells(x // size, y // size, -(-(x + width) // size), -(-(y + height) // size)) == 0
+
+    def rects_free(self, x, y, width, height):
+        # Векторный вариант is_rect_free для массивов координат левых верхних углов
+        size = self.cell_size
+        inside = (x >= 0) & (y >= 0) & (x + width <= self.width) & (y + height <= self.height)
+        col0 = np.clip(x // size, 0, self.cols)
+        row0 = np.clip(y // size, 0, self.rows)
+        col1 = np.clip(-(-(x + width) // size), 0, self.cols)
+        row1 = np.clip(-(-(y + height) // size), 0, self.rows)
+        sat = self.sat
+        blocked = sat[row1, col1] - sat[row0, col1] - sat[row1, col0] + sat[row0, col0]
+        return inside & (blocked == 0)
+
+    def fits(self, width, height):
+        # Булев массив (строки, столбцы): помещается ли свободный прямоугольник width x height
+        # с левым верхним углом в углу ячейки. Считается сразу для всех ячеек по таблице сумм
+        size = self.cell_size
+        span_cols = -(-width // size)
+        span_rows = -(-height // size)
+        max_col = min(self.cols - span_cols, (self.width - width) // size)
+        max_row = min(self.rows - span_rows, (self.height - height) // size)
+        result = np.zeros((self.rows, self.cols), dtype=bool)
+        if max_col < 0 or max_row < 0:
+            return result
+        sat = self.sat
+        top, left = slice(0, max_row + 1), slice(0, max_col + 1)
+        bottom, right = slice(span_rows, span_rows + max_row + 1), slice(span_cols, span_cols + max_col + 1)
+        blocked = sat[bottom, right] - sat[top, right] - sat[bottom, left] + sat[top, left]
+        result[top, left] = blocked == 0
+        return result
+
+# Поиск мест спавна. Один раз на карту строится преобразование расстояний свободного
+# пространства: для каждой ячейки - ближайшая ячейка, куда помещается танк.
+# Ближайшее свободное место для точки - одно обращение к массиву
+class SpawnResolver:
+    def __init__(self, occupancy, size=TANK_WIDTH):
+        self.occupancy = occupancy
+        self.size = size
+        cell_size = occupancy.cell_size
+        fits = occupancy.fits(size, size)
+        rows, cols = fits.shape
+        # Координаты всех подходящих позиций (для поиска с учётом расстояния между спавнами)
+        fit_rows, fit_cols = np.nonzero(fits)
+        self.free_x = fit_cols * cell_size
+        self.free_y = fit_rows * cell_size
+
+        # Волна от всех подходящих ячеек сразу (8-связность): на каждом шаге незанятые
+        # ячейки получают ближайшую ячейку от соседа, до которого волна уже дошла
+        self.nearest = np.full((rows, cols), -1, dtype=np.int32)  # Плоский индекс ближайшей подходящей ячейки
+        self.nearest[fits] = (fit_rows * cols + fit_cols).astype(np.int32)
+        while fits.any() and (self.nearest < 0).any():
+            previous = self.nearest.copy()
+            for d_row in (-1, 0, 1):
+                for d_col in (-1, 0, 1):
+                    if not d_row and not d_col:
+                        continue
+                    target = self.nearest[max(d_row, 0):rows + min(d_row, 0), max(d_col, 0):cols + min(d_col, 0)]
+                    source = previous[max(-d_row, 0):rows + min(-d_row, 0), max(-d_col, 0):cols + min(-d_col, 0)]
+                    update = (target < 0) & (source >= 0)
+                    target[update] = source[update]
+
+    def nearest_free(self, x, y):
+        # Ближайшая к (x, y) позиция, куда помещается танк, или None, если на карте нет места
+        if self.occupancy.is_rect_free(x, y, self.size, self.size):
+            return x, y
+        cell_size = self.occupancy.cell_size
+        row = min(max(y // cell_size, 0), self.nearest.shape[0] - 1)
+        col = min(max(x // cell_size, 0), self.nearest.shape[1] - 1)
+        index = self.nearest[row, col]
+        if index < 0:
+            return None
+        cols = self.nearest.shape[1]
+        return int(index % cols) * cell_size, int(index // cols) * cell_size
+
+    def resolve(self, points, min_separation=0, taken=()):
+        # Свободные позиции для каждой точки, не ближе min_separation к уже занятым.
+        # Точки, для которых места не нашлось, пропускаются
+        taken = list(taken)
+        resolved = []
+        for x, y in points:
+            position = self.nearest_free(x, y)
+            if position is None or self.too_close(position, taken, min_separation):
+                position = self.nearest_separated(x, y, taken, min_separation)
+            if position is not None:
+                resolved.append(position)
+                taken.append(position)
+        return resolved
+
+    @staticmethod
+    def too_close(position, taken, min_separation):
+        return any(math.hypot(position[0] - x, position[1] - y) < min_separation for x, y in taken)
+
+    def nearest_separated(self, x, y, taken, min_separation):
+        # Ближайшая к точке позиция среди всех, что не ближе min_separation к занятым
+        allowed = np.ones(len(self.free_x), dtype=bool)
+        for taken_x, taken_y in taken:
+            allowed &= np.hypot(self.free_x - taken_x, self.free_y - taken_y) >= min_separation
+        candidates = np.flatnonzero(allowed)
+        if not candidates.size:
+            return None
+        best = candidates[np.argmin(np.hypot(self.free_x[candidates] - x, self.free_y[candidates] - y))]
+        return int(self.free_x[best]), int(self.free_y[best])
+
+# Выбор случайного свободного места. Индекс всех позиций, куда помещается объект,
+# строится один раз на карту; позиция выбирается равновероятно за O(1).
+# Зоны исключения (прямоугольники) проверяются несколькими попытками,
+# после чего кандидаты отфильтровываются векторно
+class FreeCellSampler:
+    ATTEMPTS = 8
+
+    def __init__(self, occupancy, size):
+        self.size = size
+        fit_rows, fit_cols = np.nonzero(occupancy.fits(size, size))
+        self.free_x = fit_cols * occupancy.cell_size
+        self.free_y = fit_rows * occupancy.cell_size
+
+    def is_excluded(self, x, y, exclusions):
+        rect = pygame.Rect(x, y, self.size, self.size)
+        return rect.collidelist(exclusions) >= 0
+
+    def sample(self, exclusions=(), rng=random):
+        # Случайная свободная позиция вне зон исключения или None, если такой нет
+        count = len(self.free_x)
+        if not count:
+            return None
+        exclusions = list(exclusions)
+        for _ in range(self.ATTEMPTS):
+            index = rng.randrange(count)
+            x, y = int(self.free_x[index]), int(self.free_y[index])
+            if not self.is_excluded(x, y, exclusions):
+                return x, y
+        allowed = np.ones(count, dtype=bool)
+        for zone in exclusions:
+            allowed &= ~(
+                (self.free_x < zone.right) & (self.free_x + self.size > zone.left)
+                & (self.free_y < zone.bottom) & (self.free_y + self.size > zone.top)
+            )
+        candidates = np.flatnonzero(allowed)
+        if not candidates.size:
+            return None
+        index = candidates[rng.randrange(candidates.size)]
+        return int(self.free_x[index]), int(self.free_y[index])
+
+# Общее поле потока для всех противников. Волна (BFS) от ячейки игрока по ячейкам,
+# куда помещается танк, даёт расстояние до игрока; для каждой ячейки запоминается
+# направление на соседа, который на шаг ближе. Поле пересчитывается только когда
+# игрок переходит в другую ячейку, а каждый противник лишь читает из него свой шаг
+class FlowField:
+    def __init__(self, occupancy, size=TANK_WIDTH, worker=PATHFINDING_WORKER):
+        self.cell_size = occupancy.cell_size
+        self.passable = occupancy.fits(size, size)
+        rows, cols = self.passable.shape
+        self.unreachable = rows * cols
+        self.distance = np.full((rows, cols), self.unreachable, dtype=np.int32)
+        self.direction = np.full((rows, cols), -1, dtype=np.int8)
+        self.target_cell = None
+        self.requested_cell = None
+        self.service = PathfindingService.start(self.passable) if worker else None
+
+    def cell_of(self, x, y):
+        rows, cols = self.passable.shape
+        return min(max(y // self.cell_size, 0), rows - 1), min(max(x // self.cell_size, 0), cols - 1)
+
+    def update(self, target_x, target_y):
+        # Возвращает True, если поле было пересчитано (или пришло из процесса поиска пути)
+        updated = False
+        if self.service is not None:
+            result = self.service.poll()
+            if result is not None:
+                self.target_cell, self.distance, self.direction = result
+                updated = True
+            elif not self.service.alive:
+                self.close()
+        cell = self.cell_of(target_x, target_y)
+        if cell == self.requested_cell:
+            return updated
+        self.requested_cell = cell
+        if self.service is None or self.target_cell is None:
+            # Первое поле считается сразу, чтобы противникам было куда ехать с первого шага
+            self.target_cell = cell
+            self.compute(*cell)
+            return True
+        # Пока поле считается в другом процессе, противники едут по предыдущему
+        self.service.submit(cell)
+        return updated
+
+    def compute(self, target_row, target_col):
+        self.distance, self.direction = compute_flow_field(self.passable, target_row, target_col)
+
+    def close(self):
+        # Массивы из общей памяти копируются, чтобы поле оставалось рабочим после остановки процесса
+        if self.service is not None:
+            self.distance = self.distance.copy()
+            self.direction = self.direction.copy()
+            self.service.close()
+            self.service = None
+
+    def distance_at(self, x, y):
+        return int(self.distance[self.cell_of(x, y)])
+
+# Индекс точек по ячейкам размера cell_size: точки сортируются по номеру ячейки, и
+# все точки из 3x3 ячеек вокруг каждого запроса находятся двоичным поиском сразу для всех
+# запросов. Все точки ближе cell_size к запросу оказываются среди кандидатов
+class PointIndex:
+    def __init__(self, points, cell_size):
+        self.points = points
+        self.cell_size = cell_size
+        self.cols = WIDTH // cell_size + 3  # С запасом на точки у краёв и за ними
+        keys = self.keys(points)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def keys(self, points):
+        cells = np.maximum(points // self.cell_size + 1, 0)
+        return cells[:, 1] * self.cols + np.minimum(cells[:, 0], self.cols - 1)
+
+    def candidates(self, queries):
+        # Пары (индекс запроса, индекс точки) для точек из соседних с запросом ячеек
+        base = self.keys(queries)
+        offsets = np.array([row * self.cols + col for row in (-1, 0, 1) for col in (-1, 0, 1)])
+        neighbours = (base[:, None] + offsets).ravel()
+        start = np.searchsorted(self.sorted_keys, neighbours, "left")
+        counts = np.searchsorted(self.sorted_keys, neighbours, "right") - start
+        total = int(counts.sum())
+        # Развёртка диапазонов [start, start + count) в один массив позиций
+        first = np.repeat(start - (np.cumsum(counts) - counts), counts)
+        positions = first + np.arange(total)
+        query = np.repeat(np.arange(len(neighbours)) // len(offsets), counts)
+        return query, self.order[positions]
+
+# Пакетное управление противниками: положения собираются в массивы NumPy, и направления
+# для всего пакета считаются за один векторный проход. Желаемое направление берётся из поля
+# потока (без пути - прямо на цель), к нему добавляется расталкивание с соседями, а повороты
+# в препятствия отбрасываются проверкой свободного места на шаг вперёд
+class Steering:
+    DIRECTIONS = np.array(DIRECTION_VECTORS, dtype=np.float64)  # (4, 2), порядок - коды DIR_*
+
+    def __init__(self, occupancy, flow_field, influence):
+        self.occupancy = occupancy
+        self.flow_field = flow_field
+        self.influence = influence
+
+    def steer(self, enemies, allies, target):
+        # enemies - танки пакета, allies - PointIndex центров всех противников, target - цель.
+        # Возвращает массив кодов DIR_* (-1 - стоять на месте)
+        flow_field = self.flow_field
+        size = flow_field.cell_size
+        rows, cols = flow_field.passable.shape
+        positions = np.array([enemy.rect.topleft for enemy in enemies], dtype=np.int64).reshape(-1, 2)
+        x, y = positions[:, 0], positions[:, 1]
+        cells = np.clip(y // size, 0, rows - 1), np.clip(x // size, 0, cols - 1)
+        flow = flow_field.direction[cells]
+        moving = flow_field.distance[cells] * size > ENEMY_KEEP_DISTANCE
+
+        # Направление к цели: по полю потока, без пути - нормированный вектор на цель
+        centers = positions + (TANK_WIDTH // 2, TANK_HEIGHT // 2)
+        to_target = np.subtract(target.rect.center, centers, dtype=np.float64)
+        to_target /= np.maximum(np.hypot(to_target[:, 0], to_target[:, 1]), 1)[:, None]
+        desired = np.where((flow >= 0)[:, None], self.DIRECTIONS[flow], to_target)
+        desired[~moving] = 0
+
+        # Расталкивание: от каждого соседа ближе радиуса, сильнее при сближении.
+        # Кандидаты в соседи берутся из соседних ячеек индекса, расстояния считаются только для них
+        pair, ally = allies.candidates(centers)
+        offset_x = centers[pair, 0] - allies.points[ally, 0]
+        offset_y = centers[pair, 1] - allies.points[ally, 1]
+        dist_sq = offset_x * offset_x + offset_y * offset_y
+        near = (dist_sq < STEER_SEPARATION_RADIUS ** 2) & (dist_sq > 0)  # Без самого себя
+        pair, offset_x, offset_y = pair[near], offset_x[near], offset_y[near]
+        dist = np.sqrt(dist_sq[near])
+        weight = (1 - dist / STEER_SEPARATION_RADIUS) / dist
+        separation = np.stack((
+            np.bincount(pair, offset_x * weight, len(enemies)),
+            np.bincount(pair, offset_y * weight, len(enemies)),
+        ), axis=1)
+
+        # Оценка четырёх направлений; повороты в препятствия отбрасываются.
+        # Направление поля потока не проверяется - путь по нему уже обходит препятствия
+        score = (desired + STEER_SEPARATION_WEIGHT * separation) @ self.DIRECTIONS.T
+
+        # Тактика по картам влияния: насколько лучше ячейка впереди, чем текущая
+        reloading = np.array([enemy.reloading() for enemy in enemies], dtype=bool)
+        score += self.influence.gain(centers, self.DIRECTIONS, reloading)
+
+        step = (self.DIRECTIONS * STEER_LOOKAHEAD).astype(np.int64)
+        free = self.occupancy.rects_free(x[:, None] + step[:, 0], y[:, None] + step[:, 1], TANK_WIDTH, TANK_HEIGHT)
+        free[np.arange(len(flow)), flow] |= (flow >= 0) & moving
+        score[~free] = -np.inf
+        best = score.argmax(axis=1)
+        return np.where(score[np.arange(len(best)), best] >= STEER_MIN_SCORE, best, -1)
+
+# Карты влияния на грубой сетке: угроза (линии огня игрока и его пули), укрытия (ячейки,
+# которые не видны игроку) и плотность союзников. Карты не перестраиваются каждый шаг:
+# линии огня и укрытия меняются, только когда игрок переходит в другую ячейку, пули
+# снимаются со старых ячеек и ставятся на новые, союзники учитываются при смене ячейки
+class InfluenceMap:
+    def __init__(self, occupancy, cell_size=INFLUENCE_CELL_SIZE):
+        self.occupancy = occupancy
+        self.cell_size = cell_size
+        self.cols = -(-occupancy.width // cell_size)
+        self.rows = -(-occupancy.height // cell_size)
+        # Грубая ячейка непроходима, если в ней есть занятая ячейка карты занятости
+        factor = cell_size // occupancy.cell_size
+        fine = np.zeros((self.rows * factor, self.cols * factor), dtype=bool)
+        fine[:occupancy.rows, :occupancy.cols] = occupancy.blocked
+        self.blocked = fine.reshape(self.rows, factor, self.cols, factor).any(axis=(1, 3))
+
+        shape = (self.rows, self.cols)
+        self.lanes = np.zeros(shape, dtype=np.float32)  # Линии огня игрока
+        self.bullets = np.zeros(shape, dtype=np.float32)  # Ячейки на пути пуль игрока
+        self.cover = np.zeros(shape, dtype=np.float32)  # Ячейки, не видные игроку
+        self.allies = np.zeros(shape, dtype=np.float32)  # Число противников в ячейке
+        self.bullet_cells = np.zeros(0, dtype=np.int64)  # Ячейки пуль, учтённые на прошлом шаге
+        self.player_cell = None
+
+    @property
+    def threat(self):
+        return self.lanes + self.bullets
+
+    def cell_of(self, x, y):
+        return min(max(int(y) // self.cell_size, 0), self.rows - 1), min(max(int(x) // self.cell_size, 0), self.cols - 1)
+
+    def update_player(self, x, y):
+        # Линии огня и укрытия пересчитываются только при смене ячейки игрока
+        cell = self.cell_of(x, y)
+        if cell == self.player_cell:
+            return
+        self.player_cell = cell
+        row, col = cell
+        self.lanes.fill(0)
+        # Пули летят вдоль осей: под огнём строка и столбец игрока до первого препятствия
+        for d_row, d_col in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            r, c = row, col
+            while 0 <= r < self.rows and 0 <= c < self.cols and not self.blocked[r, c]:
+                self.lanes[r, c] = 1
+                r += d_row
+                c += d_col
+        self.cover = (~self.visible_from(x, y) & ~self.blocked).astype(np.float32)
+
+    def visible_from(self, x, y):
+        # Видимость центров всех грубых ячеек из точки: лучи прореживаются точками,
+        # которые проверяются по карте занятости сразу для всех ячеек
+        occupancy = self.occupancy
+        centers_y = (np.arange(self.rows) + 0.5) * self.cell_size
+        centers_x = (np.arange(self.cols) + 0.5) * self.cell_size
+        t = np.linspace(0, 1, INFLUENCE_VISIBILITY_SAMPLES)
+        sample_y = y + (centers_y[:, None, None] - y) * t  # (строки, 1, точки)
+        sample_x = x + (centers_x[None, :, None] - x) * t  # (1, столбцы, точки)
+        rows = np.clip((sample_y // occupancy.cell_size).astype(np.int64), 0, occupancy.rows - 1)
+        cols = np.clip((sample_x // occupancy.cell_size).astype(np.int64), 0, occupancy.cols - 1)
+        return ~occupancy.blocked[rows, cols].any(axis=2)
+
+    def update_bullets(self, store):
+        # Пули игрока: снимаются со старых ячеек и ставятся на новые вместе с путём впереди
+        flat = self.bullets.ravel()
+        np.subtract.at(flat, self.bullet_cells, 1)
+        n = store.count
+        mine = store.owner[:n] == OWNER_PLAYER
+        ahead = np.arange(INFLUENCE_BULLET_LOOKAHEAD + 1) * self.cell_size
+        x = store.x[:n][mine, None] + np.sign(store.vx[:n][mine, None]) * ahead
+        y = store.y[:n][mine, None] + np.sign(store.vy[:n][mine, None]) * ahead
+        inside = (x >= 0) & (x < self.occupancy.width) & (y >= 0) & (y < self.occupancy.height)
+        cells = (y[inside] // self.cell_size).astype(np.int64) * self.cols + (x[inside] // self.cell_size).astype(np.int64)
+        np.add.at(flat, cells, 1)
+        self.bullet_cells = cells
+
+    def update_ally(self, enemy):
+        cell = self.cell_of(*enemy.rect.center)
+        if cell != enemy.influence_cell:
+            if enemy.influence_cell is not None:
+                self.allies[enemy.influence_cell] -= 1
+            self.allies[cell] += 1
+            enemy.influence_cell = cell
+
+    def remove_ally(self, enemy):
+        if enemy.influence_cell is not None:
+            self.allies[enemy.influence_cell] -= 1
+            enemy.influence_cell = None
+
+    def gain(self, centers, directions, reloading):
+        # Выигрыш от шага в каждом из направлений (m, 4): разница оценки ячейки впереди и текущей.
+        # Готовые к выстрелу противники только расходятся друг от друга (и заходят с разных сторон),
+        # перезаряжающиеся ещё уходят с линий огня и прячутся за препятствиями
+        size = self.cell_size
+        here = centers // size
+        ahead = (here[:, None, :] + directions[None, :, :]).astype(np.int64)
+        rows = np.minimum(np.maximum(ahead[..., 1], 0), self.rows - 1)
+        cols = np.minimum(np.maximum(ahead[..., 0], 0), self.cols - 1)
+        here_rows = np.minimum(np.maximum(here[:, 1], 0), self.rows - 1).astype(np.int64)
+        here_cols = np.minimum(np.maximum(here[:, 0], 0), self.cols - 1).astype(np.int64)
+        safety = INFLUENCE_COVER_WEIGHT * self.cover - INFLUENCE_THREAT_WEIGHT * self.threat
+        # Сам противник в своей ячейке не считается
+        crowd = -INFLUENCE_ALLY_WEIGHT * self.allies
+        gain = crowd[rows, cols] - (crowd[here_rows, here_cols] + INFLUENCE_ALLY_WEIGHT)[:, None]
+        gain += np.where(reloading[:, None], safety[rows, cols] - safety[here_rows, here_cols][:, None], 0)
+        return gain
+
+# Поле потока к ячейке цели: поиск в ширину по всей сетке сразу (фронт растёт на одну ячейку за шаг).
+# Возвращает расстояния (в ячейках) и направления к цели (коды DIR_*, -1 - некуда ехать)
+def compute_flow_field(passable, target_row, target_col):
+    unreachable = passable.size
+    distance = np.full(passable.shape, unreachable, dtype=np.int32)
+    reached = np.zeros_like(passable)
+    reached[target_row, target_col] = True
+    distance[target_row, target_col] = 0
+    step = 0
+    while True:
+        step += 1
+        grown = reached.copy()
+        grown[1:, :] |= reached[:-1, :]
+        grown[:-1, :] |= reached[1:, :]
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown &= passable
+        grown[target_row, target_col] = True
+        front = grown & ~reached
+        if not front.any():
+            break
+        distance[front] = step
+        reached = grown
+
+    # Направление на соседа с наименьшим расстоянием (порядок - коды DIR_*)
+    padded = np.pad(distance, 1, constant_values=unreachable)
+    neighbours = np.stack((
+        padded[:-2, 1:-1],  # сверху
+        padded[2:, 1:-1],  # снизу
+        padded[1:-1, :-2],  # слева
+        padded[1:-1, 2:],  # справа
+    ))
+    best = neighbours.argmin(axis=0)
+    closer = np.take_along_axis(neighbours, best[None], axis=0)[0] < distance
+    return distance, np.where(closer, best, -1).astype(np.int8)
+
+# Процесс поиска пути: сетка проходимости и два буфера результата лежат в общей памяти,
+# по каналу передаются только номер буфера и ячейка цели
+def pathfinding_worker(connection, parent_connection, blocks, shape):
+    # После fork процесс наследует обработчики сигналов SDL (и не завершался бы по terminate)
+    # и копию родительского конца канала (и не получил бы EOF после гибели родителя)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    parent_connection.close()
+    passable = np.ndarray(shape, dtype=bool, buffer=blocks[0].buf)
+    slots = [(np.ndarray(shape, dtype=np.int32, buffer=distance.buf), np.ndarray(shape, dtype=np.int8, buffer=direction.buf))
+             for distance, direction in (blocks[1:3], blocks[3:5])]
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        slot, row, col = request
+        distance, direction = compute_flow_field(passable, row, col)
+        slots[slot][0][:] = distance
+        slots[slot][1][:] = direction
+        connection.send(request)
+
+# Асинхронный поиск пути в отдельном процессе. Одновременно выполняется один запрос; новые
+# цели, пришедшие за это время, схлопываются в последнюю. Результат пишется в буфер,
+# который сейчас не читают противники, и после ответа буферы меняются местами
+class PathfindingService:
+    @classmethod
+    def start(cls, passable):
+        # Процесс запускается через fork: при spawn дочерний процесс заново импортировал бы
+        # игру вместе с инициализацией окна. Без fork возвращается None
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        return cls(passable, multiprocessing.get_context("fork"))
+
+    def __init__(self, passable, context):
+        shape = passable.shape
+        self.blocks = []
+        self.passable = self.shared_array(shape, bool)
+        self.passable[:] = passable
+        self.slots = [(self.shared_array(shape, np.int32), self.shared_array(shape, np.int8)) for _ in range(2)]
+        self.slot = 0  # Буфер, который сейчас читают противники
+        self.busy = False  # Выполняется ли запрос
+        self.pending = None  # Последняя цель, ждущая отправки
+        self.alive = True
+        self.requests = 0
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=pathfinding_worker, args=(child, self.connection, self.blocks, shape), daemon=True)
+        self.process.start()
+        child.close()
+
+    def shared_array(self, shape, dtype):
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+        self.blocks.append(block)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def submit(self, cell):
+        self.pending = cell
+        self.flush()
+
+    def flush(self):
+        if self.busy or self.pending is None or not self.alive:
+            return
+        row, col = self.pending
+        self.pending = None
+        try:
+            self.connection.send((1 - self.slot, int(row), int(col)))
+        except OSError:
+            self.alive = False
+            return
+        self.busy = True
+        self.requests += 1
+
+    def poll(self):
+        # Готовое поле (ячейка цели, расстояния, направления) или None, если ответа ещё нет
+        if not self.busy:
+            return None
+        try:
+            if not self.connection.poll():
+                return None
+            slot, row, col = self.connection.recv()
+        except (EOFError, OSError):
+            self.alive = False
+            return None
+        self.busy = False
+        self.slot = slot
+        self.flush()
+        distance, direction = self.slots[slot]
+        return (row, col), distance, direction
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        self.passable = self.slots = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        self.alive = False
+
+# Проверка прямой видимости: луч проходит по ячейкам карты занятости алгоритмом DDA.
+# Результат кэшируется для пары ячеек (луч идёт между их центрами); кэш сбрасывается
+# только при изменении карты
+class LineOfSight:
+    def __init__(self, occupancy, cache_size=LOS_CACHE_SIZE):
+        self.occupancy = occupancy
+        self.cache_size = cache_size
+        self.cache = {}  # (ячейка, ячейка) -> видимость
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def cell_of(self, x, y):
+        size = self.occupancy.cell_size
+        return (min(max(int(y // size), 0), self.occupancy.rows - 1),
+                min(max(int(x // size), 0), self.occupancy.cols - 1))
+
+    def visible(self, x0, y0, x1, y1):
+        start = self.cell_of(x0, y0)
+        end = self.cell_of(x1, y1)
+        key = (start, end) if start <= end else (end, start)  # Видимость симметрична
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            result = self.trace(*key)
+            self.cache[key] = result
+        else:
+            self.hits += 1
+        return result
+
+    def trace(self, start, end):
+        # DDA по ячейкам от центра start до центра end
+        blocked = self.occupancy.blocked
+        row, col = start
+        end_row, end_col = end
+        d_row = end_row - row
+        d_col = end_col - col
+        step_row = 1 if d_row > 0 else -1
+        step_col = 1 if d_col > 0 else -1
+        # Параметр t вдоль луча (0 - начало, 1 - конец): шаг на одну ячейку и ближайшая граница
+        t_delta_row = 1 / abs(d_row) if d_row else math.inf
+        t_delta_col = 1 / abs(d_col) if d_col else math.inf
+        t_max_row = t_delta_row / 2
+        t_max_col = t_delta_col / 2
+        while True:
+            if blocked[row, col]:
+                return False
+            if row == end_row and col == end_col:
+                return True
+            if t_max_col < t_max_row:
+                col += step_col
+                t_max_col += t_delta_col
+            else:
+                row += step_row
+                t_max_row += t_delta_row
 
-# Функция для создания препятствий для карты
-def create_obstacles(map_name):
+# Функция для создания препятствий для карты (rng - генератор случайных чисел карты)
+def create_obstacles(map_name, rng=random):
     obstacles = []
     
     if map_name == "map1":  # Underground_Storage
@@ -367,21 +1667,20 @@ def create_obstacles(map_name):
         # Создаем сетку препятствий
         for x in range(200, WIDTH - 200, 200):
             for y in range(150, HEIGHT - 150, 150):
-                if random.random() < 0.6:  # 60% chance to place obstacle
+                if rng.random() < 0.6:  # 60% chance to place obstacle
                     obstacles.append(Obstacle(x, y, color))
     
     elif map_name == "map2":  # Castle_Lawn
         color = LIGHT_GRAY
-        # 8 хаотично расположенных препятствий
+        # 8 хаотично расположенных препятствий (число попыток на каждое ограничено)
         for _ in range(8):
-            valid_position = False
-            while not valid_position:
-                x = random.randint(50, WIDTH - 50 - OBSTACLE_WIDTH)
-                y = random.randint(50, HEIGHT - 50 - OBSTACLE_HEIGHT)
+            for _ in range(100):
+                x = rng.randint(50, WIDTH - 50 - OBSTACLE_WIDTH)
+                y = rng.randint(50, HEIGHT - 50 - OBSTACLE_HEIGHT)
                 # Проверяем, чтобы препятствие не было слишком близко к центру
                 if (abs(x - WIDTH//2) > 150 or abs(y - HEIGHT//2) > 150):
-                    valid_position = True
-            obstacles.append(Obstacle(x, y, color))
+                    obstacles.append(Obstacle(x, y, color))
+                    break
     
     elif map_name == "map3":  # Besieged_City
         color = CANYON
@@ -398,7 +1697,7 @@ def create_obstacles(map_name):
     return obstacles
 
 # Функция для получения позиций спавна игрока и врагов
-def get_spawn_positions(map_name, obstacles, num_enemies):
+def get_spawn_positions(map_name, spawn_resolver, num_enemies):
     player_spawn = None
     enemy_spawns = []
     
@@ -433,82 +1732,431 @@ def get_spawn_positions(map_name, obstacles, num_enemies):
             (WIDTH//2, HEIGHT - 150)  # низ центр
         ]
     
-    # Проверяем, что позиции не в препятствиях
-    if not is_position_valid(player_spawn[0], player_spawn[1], obstacles):
-        # Если позиция игрока в препятствии, ищем ближайшую свободную
-        for offset in range(0, 300, 50):
-            for x in range(player_spawn[0] - offset, player_spawn[0] + offset + 1, 50):
-                for y in range(player_spawn[1] - offset, player_spawn[1] + offset + 1, 50):
-                    if 0 <= x <= WIDTH - TANK_WIDTH and 0 <= y <= HEIGHT - TANK_HEIGHT:
-                        if is_position_valid(x, y, obstacles):
-                            player_spawn = (x, y)
-                            break
-                else:
-                    continue
-                break
-            else:
-                continue
-            break
-    
-    # Проверяем позиции врагов
-    valid_enemy_spawns = []
-    for spawn in enemy_spawns:
-        if is_position_valid(spawn[0], spawn[1], obstacles):
-            valid_enemy_spawns.append(spawn)
-        else:
-            # Ищем ближайшую свободную позицию
-            for offset in range(0, 300, 50):
-                for x in range(spawn[0] - offset, spawn[0] + offset + 1, 50):
-                    for y in range(spawn[1] - offset, spawn[1] + offset + 1, 50):
-                        if 0 <= x <= WIDTH - TANK_WIDTH and 0 <= y <= HEIGHT - TANK_HEIGHT:
-                            if is_position_valid(x, y, obstacles):
-                                valid_enemy_spawns.append((x, y))
-                                break
-                    else:
-                        continue
-                    break
-                else:
-                    continue
-                break
-    
-    # Ограничиваем количество врагов
-    enemy_spawns = valid_enemy_spawns[:num_enemies]
-    
+    # Если позиция занята, берём ближайшую свободную; спавны не ставятся вплотную друг к другу
+    player_spawn = spawn_resolver.nearest_free(*player_spawn)
+    enemy_spawns = spawn_resolver.resolve(enemy_spawns[:num_enemies], SPAWN_MIN_SEPARATION, [player_spawn])
+
     return player_spawn, enemy_spawns
 
+# Заливка от стартовой ячейки по проходимым ячейкам (4-связность)
+def flood_fill(passable, row, col):
+    reached = np.zeros_like(passable)
+    if not passable[row, col]:
+        return reached
+    reached[row, col] = True
+    while True:
+        grown = reached.copy()
+        grown[1:, :] |= reached[:-1, :]
+        grown[:-1, :] |= reached[1:, :]
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown &= passable
+        if (grown == reached).all():
+            return reached
+        reached = grown
+
+# Раскладка карты: препятствия и всё, что из них считается один раз (сетки, спавны)
+class MapLayout:
+    def __init__(self, map_name, seed, obstacles):
+        self.map_name = map_name
+        self.seed = seed
+        self.obstacles = obstacles
+        self.obstacle_grid = ObstacleGrid(obstacles)
+        self.obstacle_rects = rects_to_array(obstacle.rect for obstacle in obstacles)
+        self.occupancy = OccupancyGrid(obstacles)
+        self.spawn_resolver = SpawnResolver(self.occupancy)
+        self.bonus_sampler = FreeCellSampler(self.occupancy, BONUS_SIZE)
+        self.player_spawn, self.enemy_spawns = get_spawn_positions(
+            map_name, self.spawn_resolver, MAP_ENEMY_COUNTS[map_name]
+        )
+
+    def unreachable_spawns(self):
+        # Спавны противников, до которых игрок не может доехать
+        passable = self.occupancy.fits(TANK_WIDTH, TANK_HEIGHT)
+        size = self.occupancy.cell_size
+        reached = flood_fill(passable, self.player_spawn[1] // size, self.player_spawn[0] // size)
+        return [(x, y) for x, y in self.enemy_spawns if not reached[y // size, x // size]]
+
+    def is_connected(self):
+        # Игрок должен иметь возможность доехать до каждого противника
+        return not self.unreachable_spawns()
+
+# Раскладка, которая не прошла проверку связности, чинится: препятствия убираются по одному,
+# начиная с ближайшего к недостижимым спавнам (и к игроку), пока карта не станет связной.
+# Без препятствий карта связна всегда, поэтому цикл конечен
+def repair_connectivity(layout):
+    obstacles = list(layout.obstacles)
+    while obstacles and not layout.is_connected():
+        spawns = layout.unreachable_spawns() + [layout.player_spawn]
+        obstacles.remove(min(obstacles, key=lambda obstacle: min(
+            math.hypot(obstacle.rect.centerx - x - TANK_WIDTH // 2, obstacle.rect.centery - y - TANK_HEIGHT // 2)
+            for x, y in spawns
+        )))
+        layout = MapLayout(layout.map_name, layout.seed, obstacles)
+    return layout
+
+MAP_CACHE = OrderedDict()  # (карта, сид) -> раскладка
+
+# Генерация карты по сиду с проверкой связности; раскладки кэшируются,
+# поэтому повторные матчи, реплеи и замеры с тем же сидом не генерируют карту заново
+def generate_map(map_name, seed=None):
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    key = (map_name, seed)
+    layout = MAP_CACHE.get(key)
+    if layout is not None:
+        MAP_CACHE.move_to_end(key)
+        return layout
+    rng = random.Random(seed)
+    for _ in range(MAP_GENERATION_ATTEMPTS):
+        layout = MapLayout(map_name, seed, create_obstacles(map_name, rng))
+        if layout.is_connected():
+            break
+    else:
+        layout = repair_connectivity(layout)
+    MAP_CACHE[key] = layout
+    if len(MAP_CACHE) > MAP_CACHE_SIZE:
+        MAP_CACHE.popitem(last=False)
+    return layout
+
+# Экран результатов
+class ResultsScreen(MenuScreen):
+    def __init__(self, time_elapsed, bonuses_collected, score, victory, player_name):
+        super().__init__()
+        font = get_font(40)
+
+        # Отображение результатов
+        result_text = f"{player_name}, Победа!" if victory else f"{player_name}, Поражение!"
+        time_text = f"Время: {time_elapsed:.2f} сек"
+        bonuses_text = f"Бонусов собрано: {bonuses_collected}"
+        score_text = f"Счёт: {score}"
+
+        # Весь экран статичен и рендерится один раз
+        self.static = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.static.fill(WHITE)
+        self.static.blit(font.render(result_text, True, BLACK), (WIDTH // 2 - 150, 100))
+        self.static.blit(font.render(time_text, True, BLACK), (WIDTH // 2 - 100, 180))
+        self.static.blit(font.render(bonuses_text, True, BLACK), (WIDTH // 2 - 100, 260))
+        self.static.blit(font.render(score_text, True, BLACK), (WIDTH // 2 - 100, 340))
+
+        # Кнопка "Вернуться в меню"
+        self.return_button = MenuButton((WIDTH // 2 - 100, 420, 200, 50), "Вернуться в меню")
+        self.return_button.draw(self.static, WIDTH // 2 - 90)
+
+    def draw(self, win):
+        win.blit(self.static, (0, 0))
+
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN and self.return_button.rect.collidepoint(event.pos):
+            self.finish(True)
+        return False
+
 # Функция для отображения результатов
 def show_results(win, time_elapsed, bonuses_collected, score, victory, player_name):
-    font = pygame.font.SysFont("Arial", 40)
-    win.fill(WHITE)
+    screen = ResultsScreen(time_elapsed, bonuses_collected, score, victory, player_name)
+    # Ожидание нажатия кнопки
+    run_menu(screen, win)
+
+# Режим "Орда": решает, когда приходит следующая волна и сколько противников выпустить
+# на этом шаге, и выбирает для них свободные точки у края карты подальше от игрока
+class HordeDirector:
+    def __init__(self, spawn_resolver, rng=random):
+        free_x, free_y = spawn_resolver.free_x, spawn_resolver.free_y
+        edge = ((free_x < HORDE_EDGE_MARGIN) | (free_x > WIDTH - TANK_WIDTH - HORDE_EDGE_MARGIN)
+                | (free_y < HORDE_EDGE_MARGIN) | (free_y > HEIGHT - TANK_HEIGHT - HORDE_EDGE_MARGIN))
+        self.spawn_points = list(zip(free_x[edge].tolist(), free_y[edge].tolist()))
+        self.rng = rng
+        self.wave = 0
+        self.wave_size = 0
+        self.pending = 0  # Противники пришедших волн, ещё не вышедшие на карту
+        self.next_wave = SIM_CLOCK.now()
+
+    def update(self, alive):
+        # Сколько противников выпустить на этом шаге
+        now = SIM_CLOCK.now()
+        if now >= self.next_wave or not (alive or self.pending):
+            self.wave += 1
+            self.wave_size = HORDE_FIRST_WAVE if self.wave == 1 else int(self.wave_size * HORDE_WAVE_GROWTH)
+            self.pending += self.wave_size
+            self.next_wave = now + HORDE_WAVE_INTERVAL
+        return max(min(self.pending, HORDE_SPAWNS_PER_TICK, HORDE_MAX_ENEMIES - alive), 0)
+
+    def spawn_point(self, player_rect, tank_grid):
+        # Свободная точка у края карты или None, если за несколько попыток не нашлась
+        if not self.spawn_points:
+            return None
+        for _ in range(HORDE_SPAWN_ATTEMPTS):
+            x, y = self.spawn_points[self.rng.randrange(len(self.spawn_points))]
+            rect = pygame.Rect(x, y, TANK_WIDTH, TANK_HEIGHT)
+            if math.hypot(rect.centerx - player_rect.centerx, rect.centery - player_rect.centery) < HORDE_MIN_PLAYER_DISTANCE:
+                continue
+            if tank_grid.query(rect):
+                continue
+            return x, y
+        return None
 
-    # Отображение результатов
-    result_text = f"{player_name}, Победа!" if victory else f"{player_name}, Поражение!"
-    time_text = f"Время: {time_elapsed:.2f} сек"
-    bonuses_text = f"Бонусов собрано: {bonuses_collected}"
-    score_text = f"Счёт: {score}"
+# Матч: состояние игры и шаг симуляции, не зависящий от частоты отрисовки.
+# Шаг симуляции - последовательность систем над списками танков и бонусов
+class Match:
+    def __init__(self, selected_map, player_name, seed=None, horde=False):
+        SIM_CLOCK.reset()
+
+        # Загрузка изображений
+        self.enemy_images = load_enemy_images()
+        background = load_background(selected_map)
+
+        # Раскладка карты (препятствия, сетки и спавны) по сиду
+        self.layout = generate_map(selected_map, seed)
+        self.seed = self.layout.seed
+        self.obstacles = self.layout.obstacles
+        self.obstacle_grid = self.layout.obstacle_grid
+        self.occupancy = self.layout.occupancy
+        self.obstacle_rects = self.layout.obstacle_rects
+        self.static_layer = StaticLayer(background, self.obstacles)
+        self.renderer = DirtyRenderer(self.static_layer)
+        player_spawn, enemy_spawns = self.layout.player_spawn, self.layout.enemy_spawns
+
+        # Создание танков
+        self.tank_grid = LooseGrid()  # Все живые танки в сетке для проверки столкновений
+        self.tank1 = Tank(*player_spawn, get_tank_image(PLAYER_SKIN))
+        self.tank_grid.insert(self.tank1)
+        self.enemies = []
+        self.enemies_spawned = 0  # Для выбора изображения очередного противника
+        # Обновления и выстрелы противников разнесены по времени, чтобы не приходились на один шаг
+        self.ai_scheduler = AiScheduler()
+        self.horde = HordeDirector(self.layout.spawn_resolver) if horde else None
+        if horde:
+            enemy_spawns = []  # Противников выпускает HordeDirector
+        for i, enemy_spawn in enumerate(enemy_spawns):
+            self.spawn_enemy(enemy_spawn, i / len(enemy_spawns))
+
+        self.bullet_store = BulletStore()
+        self.flow_field = FlowField(self.occupancy)
+        self.line_of_sight = LineOfSight(self.occupancy)
+        self.influence = InfluenceMap(self.occupancy)
+        self.steering = Steering(self.occupancy, self.flow_field, self.influence)
+
+        # Создание бонусов
+        self.bonuses = []
+        self.bonus_sampler = self.layout.bonus_sampler
+        self.last_bonus_spawn = SIM_CLOCK.now()
+        for _ in range(BONUS_COUNT):
+            self.spawn_bonus()
+
+        # Информация об игроке
+        self.hud = Hud()
+        self.hud.add("name", "Игрок: ", (10, 10))
+        self.hud.add("score", "Счёт: ", (10, 50))
+        self.hud.add("hp", "HP: ", (10, 90))
+        self.hud.set("name", player_name)
+        if horde:
+            self.hud.add("wave", "Волна: ", (10, 130))
+            self.hud.add("enemies", "Противников: ", (10, 170))
+            self.hud.add("frame", f"Кадр (цель {HORDE_FRAME_TIME_TARGET:.0f} мс): ", (10, 210))
+        self.frame_time = 0.0  # Сглаженное время кадра, мс
+
+        self.bonuses_collected = 0
+        self.score = 0
+        self.over = False
+        self.victory = False
+
+    def spawn_enemy(self, position, phase=0.0):
+        # phase (0..1) сдвигает первое обновление и первый выстрел противника,
+        # чтобы противники не думали и не стреляли на одном шаге
+        enemy = EnemyTank(*position, self.tank1, self.enemy_images[self.enemies_spawned % len(self.enemy_images)])
+        self.enemies_spawned += 1
+        enemy.shoot_timer -= ENEMY_SHOOT_INTERVAL * phase
+        self.enemies.append(enemy)
+        self.tank_grid.insert(enemy)
+        self.ai_scheduler.add(enemy, AI_FAR_INTERVAL * phase)
+        return enemy
+
+    def spawn_bonus(self):
+        # Бонус в случайном свободном месте подальше от танков и других бонусов
+        margin = BONUS_EXCLUSION_MARGIN
+        exclusions = [tank.rect.inflate(margin * 2, margin * 2) for tank in [self.tank1] + self.enemies]
+        exclusions += [bonus.rect.inflate(margin * 2, margin * 2) for bonus in self.bonuses]
+        position = self.bonus_sampler.sample(exclusions)
+        if position is not None:
+            self.bonuses.append(Bonus(*position))
+            self.last_bonus_spawn = SIM_CLOCK.now()
+
+    def time_elapsed(self):
+        return SIM_CLOCK.now() / 1000
+
+    def step(self, keys):
+        SIM_CLOCK.advance()
+
+        # Запоминаем положения для интерполяции при отрисовке
+        self.tank1.save_position()
+        for enemy in self.enemies:
+            enemy.save_position()
+        self.bullet_store.save_positions()
+
+        self.input_system(keys)
+        if self.horde is not None:
+            self.horde_system()
+        self.influence_system()
+        self.ai_system()
+        self.update_bullets()
+        self.pickup_system()
+        self.timer_system()
+
+        # Проверка завершения игры (в режиме орды - только гибель игрока)
+        if self.horde is None and not self.enemies:
+            self.over = True
+            self.victory = True
+        elif self.tank1.hp <= 0:
+            self.over = True
+
+    def input_system(self, keys):
+        # Управление танком игрока
+        tank1 = self.tank1
+        for key, direction in PLAYER_CONTROLS:
+            if keys[key]:
+                tank1.move(*DIRECTION_VECTORS[direction], self.obstacle_grid, self.tank_grid)
+        if keys[pygame.K_SPACE]:
+            tank1.shoot(self.bullet_store, OWNER_PLAYER)
+
+    def horde_system(self):
+        # Выпуск противников очередной волны
+        horde = self.horde
+        for _ in range(horde.update(len(self.enemies))):
+            position = horde.spawn_point(self.tank1.rect, self.tank_grid)
+            if position is None:
+                break
+            self.spawn_enemy(position, horde.rng.random())
+            horde.pending -= 1
+
+    def record_frame(self, frame_ms):
+        # Время работы кадра (без ожидания) для счётчика на экране
+        self.frame_time += (frame_ms - self.frame_time) * FRAME_TIME_SMOOTHING
+
+    def close(self):
+        # Остановка процесса поиска пути
+        self.flow_field.close()
+
+    def influence_system(self):
+        # Карты влияния обновляются по изменениям с прошлого шага
+        influence = self.influence
+        influence.update_player(*self.tank1.rect.center)
+        influence.update_bullets(self.bullet_store)
+        for enemy in self.enemies:
+            influence.update_ally(enemy)
+
+    def ai_system(self):
+        # Поле потока пересчитывается, только если игрок сменил ячейку
+        self.flow_field.update(*self.tank1.rect.topleft)
+        # Центры всех противников собираются один раз за шаг для расталкивания
+        centers = np.array([enemy.rect.center for enemy in self.enemies], dtype=np.int64).reshape(-1, 2)
+        self.ally_index = PointIndex(centers, STEER_SEPARATION_RADIUS)
+        # Обновление противников, чьё время пришло
+        self.ai_scheduler.run(self.think)
+
+    def think(self, enemies):
+        # Направления для всего пакета считаются одним проходом, затем раздаются танкам
+        directions = self.steering.steer(enemies, self.ally_index, self.tank1).tolist()
+        intervals = []
+        for enemy, direction in zip(enemies, directions):
+            enemy.update(direction, self.obstacle_grid, self.tank_grid, self.bullet_store, self.line_of_sight)
+            intervals.append(enemy.think_interval(self.flow_field))
+        return intervals
+
+    def pickup_system(self):
+        # Подбор бонусов
+        tank1 = self.tank1
+        for bonus in self.bonuses[:]:
+            if tank1.rect.colliderect(bonus.rect):
+                if bonus.type == "shield":
+                    tank1.activate_shield()
+                elif bonus.type == "invulnerability":
+                    tank1.activate_invulnerability()
+                self.bonuses.remove(bonus)
+                self.bonuses_collected += 1
+                self.score += 100  # 100 очков за бонус
+
+        # Новые бонусы взамен подобранных
+        if len(self.bonuses) >= BONUS_COUNT:
+            self.last_bonus_spawn = SIM_CLOCK.now()
+        elif SIM_CLOCK.now() - self.last_bonus_spawn >= BONUS_RESPAWN_INTERVAL:
+            self.spawn_bonus()
+
+    def timer_system(self):
+        # Неуязвимость и перезарядка пуль игрока
+        self.tank1.update_invulnerability()
+        self.tank1.recharge()
+
+    def update_bullets(self):
+        store = self.bullet_store
+        store.move()
+        if not store.count:
+            return
+        tank1 = self.tank1
+
+        # Пули, вылетевшие за пределы арены, и пули, попавшие в препятствия
+        culled = store.out_of_bounds()
+        store.culled += int(culled.sum())
+        dead = culled | store.overlaps(self.obstacle_rects).any(axis=1)
+        owner = store.owner[:store.count]
+
+        # Попадания пуль игрока в противников: каждая пуля поражает первого задетого противника.
+        # С противниками сравниваются только живые пули игрока
+        player_bullets = np.flatnonzero((owner == OWNER_PLAYER) & ~dead)
+        enemies = self.enemies
+        if player_bullets.size and enemies:
+            killed = False
+            hits = store.overlaps(rects_to_array(enemy.rect for enemy in enemies), player_bullets)
+            # Пуля поражает первого ещё живого из задетых противников; если все задетые
+            # уже убиты на этом шаге, она летит дальше
+            for row in np.flatnonzero(hits.any(axis=1)).tolist():
+                for enemy_index in np.flatnonzero(hits[row]).tolist():
+                    enemy = enemies[enemy_index]
+                    if enemy.hp <= 0:
+                        continue
+                    enemy.take_damage(1)
+                    if enemy.hp <= 0:
+                        self.tank_grid.remove(enemy)
+                        self.influence.remove_ally(enemy)
+                        killed = True
+                        self.score += 1000  # 1000 очков за убийство танка
+                    dead[player_bullets[row]] = True
+                    break
+            if killed:
+                self.enemies = [enemy for enemy in enemies if enemy.hp > 0]
 
-    # Отрисовка текста
-    win.blit(font.render(result_text, True, BLACK), (WIDTH // 2 - 150, 100))
-    win.blit(font.render(time_text, True, BLACK), (WIDTH // 2 - 100, 180))
-    win.blit(font.render(bonuses_text, True, BLACK), (WIDTH // 2 - 100, 260))
-    win.blit(font.render(score_text, True, BLACK), (WIDTH // 2 - 100, 340))
+        # Попадания пуль противников в игрока
+        enemy_bullets = np.flatnonzero((owner == OWNER_ENEMY) & ~dead)
+        hit_bullets = enemy_bullets[store.overlaps(rects_to_array([tank1.rect]), enemy_bullets)[:, 0]]
+        for _ in range(len(hit_bullets)):
+            tank1.take_damage(1)
+        dead[hit_bullets] = True
 
-    # Кнопка "Вернуться в меню"
-    return_button = pygame.Rect(WIDTH // 2 - 100, 420, 200, 50)
-    pygame.draw.rect(win, GREEN, return_button)
-    win.blit(font.render("Вернуться в меню", True, BLACK), (WIDTH // 2 - 90, 430))
+        store.remove(dead)
 
-    pygame.display.update()
+    def render(self, win, alpha):
+        # alpha - доля пути от предыдущего шага симуляции к текущему
+        renderer = self.renderer
+        renderer.begin(win)  # Восстановление фона и препятствий
 
-    # Ожидание нажатия кнопки
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if return_button.collidepoint(event.pos):
-                    return
+        renderer.add_all(self.bullet_store.draw(win, alpha))
+
+        renderer.add(self.tank1.draw(win, alpha))
+        for enemy in self.enemies:
+            renderer.add(enemy.draw(win, alpha))
+
+        for bonus in self.bonuses:
+            renderer.add(bonus.draw(win))
+
+        # Отображение информации (перерисовываются только изменившиеся поля)
+        self.hud.set("score", self.score)
+        self.hud.set("hp", self.tank1.hp)
+        if self.horde is not None:
+            self.hud.set("wave", self.horde.wave)
+            self.hud.set("enemies", len(self.enemies))
+            self.hud.set("frame", round(self.frame_time))
+        renderer.add_all(self.hud.draw(win))
+
+        renderer.end()
 
 # Основная функция игры
 def main():
@@ -524,165 +2172,104 @@ def main():
 
     run = True
     clock = pygame.time.Clock()
-
-    # Загрузка изображений
-    enemy_images = load_enemy_images()
-    background = load_background(selected_map)
-
-    # Создание препятствий для выбранной карты
-    obstacles = create_obstacles(selected_map)
-
-    # Определяем количество врагов в зависимости от карты
-    if selected_map == "map1":
-        num_enemies = 3
-    elif selected_map == "map2":
-        num_enemies = 4
-    elif selected_map == "map3":
-        num_enemies = 6
-
-    # Получаем позиции спавна
-    player_spawn, enemy_spawns = get_spawn_positions(selected_map, obstacles, num_enemies)
-
-    # Создание танков
-    tank1 = Tank(*player_spawn)
-    enemies = [
-        EnemyTank(*enemy_spawns[i], tank1, enemy_images[i % len(enemy_images)])
-        for i in range(num_enemies)
-    ]
-
-    bullets = []
-    enemy_bullets = []
-    bonuses = []
-
-    # Создание бонусов
-    for _ in range(5):
-        valid_position = False
-        while not valid_position:
-            x = random.randint(0, WIDTH - BONUS_SIZE)
-            y = random.randint(0, HEIGHT - BONUS_SIZE)
-            if is_position_valid(x, y, obstacles, BONUS_SIZE):
-                valid_position = True
-        bonuses.append(Bonus(x, y))
-
-    # Время начала игры
-    start_time = time.time()
-    bonuses_collected = 0
-    score = 0
-
-    while run:
-        clock.tick(60)
-        WIN.blit(background, (0, 0))  # Отрисовка фона
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+    if selected_map == "horde":
+        match = Match(HORDE_MAP, player_name, horde=True)
+    else:
+        match = Match(selected_map, player_name)
+    accumulator = 0.0
+
+    try:
+        while run:
+            # Время кадра ограничено, чтобы после долгой паузы не догонять симуляцию бесконечно
+            accumulator += min(clock.tick(RENDER_FPS), SIM_TICK_MS * MAX_TICKS_PER_FRAME)
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    run = False
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    # Содержимое окна потеряно - "грязных" областей недостаточно
+                    match.renderer.force_full_update()
+
+            # Шаги симуляции с фиксированной частотой
+            keys = pygame.key.get_pressed()
+            while accumulator >= SIM_TICK_MS and not match.over:
+                match.step(keys)
+                accumulator -= SIM_TICK_MS
+
+            match.render(WIN, accumulator / SIM_TICK_MS)
+            match.record_frame(clock.get_rawtime())
+
+            if match.over:
+                match.close()
+                show_results(WIN, match.time_elapsed(), match.bonuses_collected, match.score,
+                             victory=match.victory, player_name=player_name)
                 run = False
-
-        # Управление танком игрока
-        keys = pygame.key.get_pressed()
-        if keys[pygame.K_w]:
-            tank1.move(0, -1, obstacles, [tank1] + enemies)
-        if keys[pygame.K_s]:
-            tank1.move(0, 1, obstacles, [tank1] + enemies)
-        if keys[pygame.K_a]:
-            tank1.move(-1, 0, obstacles, [tank1] + enemies)
-        if keys[pygame.K_d]:
-            tank1.move(1, 0, obstacles, [tank1] + enemies)
-        if keys[pygame.K_SPACE]:
-            bullet = tank1.shoot()
-            if bullet:
-                bullets.append(bullet)
-
-        # Обновление противников
-        for enemy in enemies:
-            enemy_bullet = enemy.update(obstacles, [tank1] + enemies)
-            if enemy_bullet:
-                enemy_bullets.append(enemy_bullet)
-
-        # Обновление пуль игрока
-        for bullet in bullets[:]:
-            should_remove = bullet.move(obstacles)
-            bullet.draw(WIN)
-            
-            if should_remove and bullet in bullets:
-                bullets.remove(bullet)
-                continue
-                
-            for enemy in enemies[:]:
-                if bullet.get_rect().colliderect(enemy.get_rect()):
-                    enemy.take_damage(1)
-                    if enemy.hp <= 0:
-                        enemies.remove(enemy)
-                        score += 1000  # 1000 очков за убийство танка
-                    if bullet in bullets:
-                        bullets.remove(bullet)
-                    break
-
-        # Обновление пуль противников
-        for bullet in enemy_bullets[:]:
-            should_remove = bullet.move(obstacles)
-            bullet.draw(WIN)
-            
-            if should_remove and bullet in enemy_bullets:
-                enemy_bullets.remove(bullet)
-                continue
-                
-            if bullet.get_rect().colliderect(tank1.get_rect()):
-                tank1.take_damage(1)
-                if bullet in enemy_bullets:
-                    enemy_bullets.remove(bullet)
-
-        # Обновление танков
-        tank1.draw(WIN)
-        for enemy in enemies:
-            enemy.draw(WIN)
-
-        # Обновление бонусов
-        for bonus in bonuses[:]:
-            bonus.draw(WIN)
-            if tank1.get_rect().colliderect(bonus.get_rect()):
-                if bonus.type == "shield":
-                    tank1.activate_shield()
-                elif bonus.type == "invulnerability":
-                    tank1.activate_invulnerability()
-                bonuses.remove(bonus)
-                bonuses_collected += 1
-                score += 100  # 100 очков за бонус
-
-        # Обновление препятствий
-        for obstacle in obstacles:
-            obstacle.draw(WIN)
-
-        # Обновление неуязвимости
-        tank1.update_invulnerability()
-
-        # Перезарядка пуль
-        tank1.recharge()
-
-        # Отображение информации
-        font = pygame.font.SysFont("Arial", 30)
-        # Имя игрока
-        name_text = font.render(f"Игрок: {player_name}", True, WHITE)
-        WIN.blit(name_text, (10, 10))
-        # Счет
-        score_text = font.render(f"Счёт: {score}", True, WHITE)
-        WIN.blit(score_text, (10, 50))
-        # Здоровье
-        hp_text = font.render(f"HP: {tank1.hp}", True, WHITE)
-        WIN.blit(hp_text, (10, 90))
-
-        # Проверка завершения игры
-        if not enemies:
-            time_elapsed = time.time() - start_time
-            show_results(WIN, time_elapsed, bonuses_collected, score, victory=True, player_name=player_name)
-            run = False
-        elif tank1.hp <= 0:
-            time_elapsed = time.time() - start_time
-            show_results(WIN, time_elapsed, bonuses_collected, score, victory=False, player_name=player_name)
-            run = False
-
-        pygame.display.update()
-
+    finally:
+        match.close()
     pygame.quit()
 
+# Замер производительности: python game3.2.py --bench
+def entity_memory(entity):
+    # Размер объекта вместе со словарём атрибутов, если он есть
+    size = sys.getsizeof(entity)
+    if hasattr(entity, "__dict__"):
+        size += sys.getsizeof(entity.__dict__)
+    return size
+
+def run_benchmark(map_name="map3", ticks=3000):
+    random.seed(0)
+    match = Match(map_name, "bench", seed=0)
+    print("Память на объект, байт:")
+    print(f"  Tank: {entity_memory(match.tank1)}")
+    print(f"  EnemyTank: {entity_memory(match.enemies[0])}")
+    print(f"  Bonus: {entity_memory(match.bonuses[0])}")
+    print(f"  Obstacle: {entity_memory(match.obstacles[0])}")
+
+    keys = defaultdict(bool)
+    keys[pygame.K_SPACE] = True
+    start = time.perf_counter()
+    for tick in range(ticks):
+        # Игрок по очереди едет во все стороны
+        for key, _ in PLAYER_CONTROLS:
+            keys[key] = False
+        keys[PLAYER_CONTROLS[tick // 40 % 4][0]] = True
+        match.step(keys)
+    elapsed = time.perf_counter() - start
+    match.close()
+    print(f"Шаг симуляции ({map_name}): {elapsed / ticks * 1e6:.1f} мкс")
+
+# Нагрузочный сценарий орды: волны приходят без перерыва, пока на карте не наберётся
+# HORDE_MAX_ENEMIES противников; каждый шаг симуляции сопровождается отрисовкой кадра
+def run_horde_benchmark(ticks=1800):
+    random.seed(0)
+    match = Match(HORDE_MAP, "bench", seed=0, horde=True)
+    match.tank1.hp = ticks  # Игрок не должен погибнуть до конца замера
+    keys = defaultdict(bool)
+    keys[pygame.K_SPACE] = True
+    frame_times = []
+    for tick in range(ticks):
+        for key, _ in PLAYER_CONTROLS:
+            keys[key] = False
+        keys[PLAYER_CONTROLS[tick // 40 % 4][0]] = True
+        if not match.horde.pending:
+            match.horde.next_wave = 0
+        start = time.perf_counter()
+        match.step(keys)
+        match.render(WIN, 1.0)
+        frame_times.append((time.perf_counter() - start) * 1000)
+    enemies = len(match.enemies)
+    match.close()
+    # Последняя треть замера - при полной орде
+    tail = sorted(frame_times[-ticks // 3:])
+    print(f"Противников: {enemies}, волна {match.horde.wave}")
+    print(f"Кадр (шаг + отрисовка): среднее {sum(tail) / len(tail):.2f} мс, "
+          f"95% {tail[int(len(tail) * 0.95)]:.2f} мс, цель {HORDE_FRAME_TIME_TARGET:.2f} мс")
+    print(f"Обновлений ИИ: {match.ai_scheduler.updates}, превышений бюджета: {match.ai_scheduler.overruns}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--bench" in sys.argv and "--horde" in sys.argv:
+        run_horde_benchmark()
+    elif "--bench" in sys.argv:
+        run_benchmark()
+    else:
+        main()